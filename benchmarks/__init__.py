@@ -0,0 +1,3 @@
+"""
+Benchmarks which compare optimized parts of the service with their previous implementations
+"""
@@ -0,0 +1,66 @@
+"""
+Compares recursive conversion of keys in `to_json` and `to_python` with the previous JSON round trip
+
+> python -m benchmarks.key_conversion --vertices 5000
+"""
+
+import os
+import base64
+import timeit
+import argparse
+
+import numpy as np
+
+from classification_service.utils import to_json, to_python
+from benchmarks.reference import round_trip_to_json, round_trip_to_python
+
+
+def get_task_payload(n_vertices, with_images, random_state):
+    """ A payload similar to the one of a task with 3 layers and a vector geometry
+    """
+    if with_images:
+        data = [{'layer': layer, 'image': base64.b64encode(os.urandom(150000)).decode('utf-8')}
+                for layer in ['Clouds', 'Shadows', 'Surface']]
+    else:
+        data = [{'layer': layer, 'url': '/campaigns/campaign/tasks/task/layers/{}'.format(layer)}
+                for layer in ['Clouds', 'Shadows', 'Surface']]
+
+    coords = random_state.random_sample((n_vertices, 2)).tolist()
+    return {
+        'id': 'task',
+        'bbox': [1.0, 2.0, 3.0, 4.0],
+        'crs': 32633,
+        'window_width': 512,
+        'window_height': 512,
+        'datetime': '2018-01-01',
+        'data': data,
+        'vector_data': [{'type': 'Polygon', 'coordinates': [coords]}],
+        'window': {'width': 512, 'height': 512}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks conversion of keys of task payloads')
+    parser.add_argument('--vertices', type=int, default=5000, help='Number of vertices of a task vector geometry')
+    parser.add_argument('--repeat', type=int, default=50, help='Number of repetitions')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+
+    for with_images in [True, False]:
+        payload = get_task_payload(args.vertices, with_images, random_state)
+        json_payload = round_trip_to_json(payload)
+
+        if to_json(payload) != json_payload or to_python(json_payload) != round_trip_to_python(json_payload):
+            raise RuntimeError('Converted payloads are not the same')
+
+        times = [timeit.timeit(function, number=args.repeat) / args.repeat for function in [
+            lambda: round_trip_to_json(payload), lambda: to_json(payload),
+            lambda: round_trip_to_python(json_payload), lambda: to_python(json_payload)
+        ]]
+        print('{}: to_json {:.2f}ms -> {:.2f}ms, to_python {:.2f}ms -> {:.2f}ms'.format(
+            'Base64 images' if with_images else 'layer URLs', *[1000 * time for time in times]))
+
+
+if __name__ == '__main__':
+    main()
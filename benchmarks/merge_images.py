@@ -0,0 +1,40 @@
+"""
+Compares compositing of class masks through a palette lookup table with the previous per-class color assignment
+
+> python -m benchmarks.merge_images --size 512 --classes 7
+"""
+
+import timeit
+import argparse
+
+import numpy as np
+
+from classification_service.image_utils import merge_images, merge_images_with_palette, build_palette
+from benchmarks.reference import assign_colors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks merging of class masks into an RGB image')
+    parser.add_argument('--size', type=int, default=512, help='Width and height of masks')
+    parser.add_argument('--classes', type=int, default=7, help='Number of class masks')
+    parser.add_argument('--repeat', type=int, default=50, help='Number of repetitions')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+    images = [np.repeat(random_state.randint(0, 256, size=(args.size, args.size, 1)).astype(np.uint8), 4, axis=-1)
+              for _ in range(args.classes)]
+    colors = ['#{:02x}{:02x}{:02x}'.format(*random_state.randint(0, 256, size=3)) for _ in range(args.classes)]
+    palette = build_palette(colors)
+
+    if not np.array_equal(assign_colors(images, colors), merge_images(images, colors)):
+        raise RuntimeError('Merged images are not the same')
+
+    previous_time = timeit.timeit(lambda: assign_colors(images, colors), number=args.repeat) / args.repeat
+    palette_time = timeit.timeit(lambda: merge_images_with_palette(images, palette), number=args.repeat) / args.repeat
+
+    print('{} masks of size {}x{}: previous {:.2f}ms, palette {:.2f}ms'.format(
+        args.classes, args.size, args.size, 1000 * previous_time, 1000 * palette_time))
+
+
+if __name__ == '__main__':
+    main()
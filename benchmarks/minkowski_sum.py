@@ -0,0 +1,43 @@
+"""
+Compares merging Minkowski sums of triangles one by one with a cascaded union as in `minkowski_sum`
+
+> python -m benchmarks.minkowski_sum --vertices 100 1000
+"""
+
+import time
+import argparse
+
+import numpy as np
+
+from classification_service.sampling_utils import minkowski_sum, triangulate
+from benchmarks.reference import pairwise_minkowski_sum, get_star_polygon
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks Minkowski sum of a complement of a star polygon')
+    parser.add_argument('--vertices', type=int, nargs='+', default=[100, 1000], help='Numbers of polygon vertices')
+    parser.add_argument('--window', type=int, default=20, help='Size of a square window')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+    window_shape = -args.window, -args.window
+
+    for n_vertices in args.vertices:
+        polygon = get_star_polygon(n_vertices, random_state)
+        complement = polygon.convex_hull.difference(polygon)
+
+        start_time = time.perf_counter()
+        pairwise_sum = pairwise_minkowski_sum(complement, window_shape)
+        pairwise_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        cascaded_sum = minkowski_sum(complement, window_shape)
+        cascaded_time = time.perf_counter() - start_time
+
+        print('{} vertices, {} triangles: pairwise {:.2f}s, cascaded {:.2f}s, relative area difference {:.1e}'.format(
+            n_vertices, len(triangulate(complement)), pairwise_time, cascaded_time,
+            abs(pairwise_sum.area - cascaded_sum.area) / pairwise_sum.area))
+
+
+if __name__ == '__main__':
+    main()
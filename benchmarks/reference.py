@@ -0,0 +1,84 @@
+"""
+Previous implementations of optimized functions and generators of test geometries, shared by benchmarks and tests
+"""
+
+import json
+
+import numpy as np
+import shapely.ops
+from inflection import camelize, underscore
+from shapely.geometry import Polygon
+
+from classification_service.image_utils import hex_to_rgb, MASK_THRESHOLD
+from classification_service.sampling_utils import convex_minkowski_sum, get_triangle_areas, triangulate
+
+
+def get_random_triangles(n_triangles, random_state):
+    """ Random triangles of different sizes as an array of shape `(n_triangles, 3, 2)`
+    """
+    return random_state.random_sample((n_triangles, 3, 2)) * random_state.random_sample((n_triangles, 1, 1)) * 100
+
+
+def get_star_polygon(n_vertices, random_state):
+    """ A random star-shaped polygon with a given number of vertices
+    """
+    angles = np.linspace(0, 2 * np.pi, n_vertices, endpoint=False)
+    radii = 1000 * (1 + 0.3 * random_state.random_sample(n_vertices))
+    return Polygon(np.column_stack([radii * np.cos(angles), radii * np.sin(angles)])).buffer(0)
+
+
+def sample_cumulative_areas(triangles, n_samples):
+    """ The previous sampler which selects triangles by a binary search over cumulative areas
+    """
+    cumulative_areas = np.cumsum(get_triangle_areas(triangles))
+    indices = np.searchsorted(cumulative_areas, np.random.random(n_samples) * cumulative_areas[-1], side='right')
+    return np.minimum(indices, len(cumulative_areas) - 1)
+
+
+def pairwise_minkowski_sum(geo_shape, window_shape):
+    """ The previous implementation which merges Minkowski sums of triangles into a growing shape one at a time
+    """
+    shape_union = None
+    for triangle in triangulate(geo_shape):
+        triangle_sum = convex_minkowski_sum(Polygon(triangle), window_shape)
+        shape_union = triangle_sum if shape_union is None else shape_union.union(triangle_sum)
+    return shape_union
+
+
+def delaunay_triangulate(geo_shape):
+    """ The previous implementation which clips Delaunay triangles of a convex hull with the shape and triangulates
+    the clipped parts again
+    """
+    convex_poly_list = []
+    for triangle in shapely.ops.triangulate(geo_shape):
+        reduced_shape = triangle.intersection(geo_shape)
+        convex_poly_list.extend(reduced_shape.geoms if hasattr(reduced_shape, 'geoms') else [reduced_shape])
+
+    convex_poly_list = [poly for poly in convex_poly_list if isinstance(poly, Polygon) and poly.area > 0]
+
+    return [triangle for poly in convex_poly_list for triangle in shapely.ops.triangulate(poly)]
+
+
+def assign_colors(images, colors):
+    """ The previous implementation which paints pixels of each class mask into an RGB image one class at a time
+    """
+    merged_image = np.zeros(images[0].shape[:2] + (3,), dtype=np.uint8)
+
+    for image, color in zip(images, colors):
+        merged_image[image[..., 0] >= MASK_THRESHOLD, :] = hex_to_rgb(color)
+
+    return merged_image
+
+
+def round_trip_to_python(data):
+    """ The previous implementation which serializes data to JSON and parses it back with converted keys
+    """
+    return json.loads(json.dumps(data), object_hook=lambda subdict: {underscore(key): value
+                                                                     for key, value in subdict.items()})
+
+
+def round_trip_to_json(data):
+    """ The previous implementation which serializes data to JSON and parses it back with converted keys
+    """
+    return json.loads(json.dumps(data), object_hook=lambda subdict: {camelize(key, uppercase_first_letter=False):
+                                                                     value for key, value in subdict.items()})
@@ -0,0 +1,47 @@
+"""
+Compares ear clipping in `triangulate` with the previous triangulation based on Delaunay triangulation of a convex hull
+
+> python -m benchmarks.triangulation --vertices 100 1000 10000
+"""
+
+import time
+import argparse
+
+import numpy as np
+from shapely.geometry import Point
+
+from classification_service.sampling_utils import triangulate, get_triangle_areas
+from benchmarks.reference import delaunay_triangulate, get_star_polygon
+
+MAX_DELAUNAY_VERTICES = 2000  # the previous triangulation takes too long for larger polygons
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks triangulation of star polygons with a hole')
+    parser.add_argument('--vertices', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Numbers of polygon vertices')
+    args = parser.parse_args()
+
+    random_state = np.random.RandomState(0)
+
+    for n_vertices in args.vertices:
+        polygon = get_star_polygon(n_vertices, random_state).difference(Point(0, 0).buffer(300))
+
+        start_time = time.perf_counter()
+        triangles = triangulate(polygon)
+        earcut_time = time.perf_counter() - start_time
+
+        area_error = abs(get_triangle_areas(triangles).sum() - polygon.area) / polygon.area
+        message = '{} vertices: earcut {:.4f}s ({} triangles, relative area error {:.1e})'.format(
+            n_vertices, earcut_time, len(triangles), area_error)
+
+        if n_vertices <= MAX_DELAUNAY_VERTICES:
+            start_time = time.perf_counter()
+            delaunay_triangulate(polygon)
+            message += ', previous {:.2f}s'.format(time.perf_counter() - start_time)
+
+        print(message)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+"""
+This module implements caches used throughout the package
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def get_temp_path(path):
+    """ Provides a path of a temporary file which is unique for the current process and thread. Once the temporary
+    file is written it should be moved to the given path with `os.replace`.
+
+    :param path: A path of the target file
+    :type path: str
+    :return: A path of the temporary file
+    :rtype: str
+    """
+    return '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+
+
+def save_file(path, data):
+    """ Saves data into a file in a way that other processes and threads never read a partially written file
+
+    :param path: A path of the file. Missing folders are created.
+    :type path: str
+    :param data: Content of the file
+    :type data: bytes
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    temp_path = get_temp_path(path)
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.replace(temp_path, path)
+
+
+def remove_lru_entries(entries, max_bytes):
+    """ Removes files of the least recently used entries until total size of files of remaining entries is within the
+    limit. Files which were already removed, e.g. by another process, are skipped.
+
+    :param entries: A list of entries given as their last access time, total size of their files and a list of paths
+        to their files
+    :type entries: list((float, int, list(str)))
+    :param max_bytes: Maximal total size of files in bytes
+    :type max_bytes: int
+    """
+    total_size = sum(size for _, size, _ in entries)
+
+    for _, size, paths in sorted(entries):
+        if total_size <= max_bytes:
+            break
+
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total_size -= size
+
+
+class LruCache:
+    """ A thread-safe, size-bounded least-recently-used cache. Optionally each entry also expires after a given
+    time-to-live and the total weight of entries, e.g. their memory footprint, is bounded.
+
+    The cache keeps count of hits and misses so that its efficiency can be monitored.
+    """
+    def __init__(self, maxsize=128, ttl=None, max_weight=None, weigher=None):
+        """
+        :param maxsize: Maximal number of entries in the cache
+        :type maxsize: int
+        :param ttl: Number of seconds after which an entry expires. If `None` entries never expire.
+        :type ttl: float or None
+        :param max_weight: Maximal total weight of entries in the cache. If `None` the weight is not bounded.
+        :type max_weight: int or None
+        :param weigher: A function which receives a value and returns its weight. By default each value weights 1.
+        :type weigher: function or None
+        """
+        if maxsize < 1:
+            raise ValueError('Size of the cache must be at least 1')
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigher = weigher
+
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self._total_weight = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get_item(key) is not None
+
+    def get(self, key, default=None):
+        """ Returns a value from the cache and marks it as recently used
+
+        :param key: A key of the entry
+        :param default: A value which is returned if the key is not in the cache or if it has expired
+        """
+        with self._lock:
+            item = self._get_item(key)
+            if item is None:
+                self.misses += 1
+                return default
+
+            self.hits += 1
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value):
+        """ Adds a value to the cache. If the cache is full the least recently used entries are evicted
+        """
+        weight = 1 if self.weigher is None else self.weigher(value)
+
+        with self._lock:
+            self._remove(key)
+            self._data[key] = value, self._get_expiration_time(), weight
+            self._total_weight += weight
+
+            while self._data and (len(self._data) > self.maxsize or
+                                  (self.max_weight is not None and self._total_weight > self.max_weight)):
+                self._remove(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        """ Removes an entry from the cache and returns its value
+        """
+        with self._lock:
+            item = self._remove(key)
+            return default if item is None else item[0]
+
+    def items(self):
+        """ Returns a list of all pairs of keys and values in the cache which have not expired yet
+        """
+        with self._lock:
+            return [(key, item[0]) for key, item in self._data.items() if not self._is_expired(item)]
+
+    def values(self):
+        """ Returns a list of all values in the cache which have not expired yet
+        """
+        return [value for _, value in self.items()]
+
+    def invalidate(self, condition=None):
+        """ Removes all entries for which the condition is satisfied
+
+        :param condition: A function which receives a key and decides whether its entry should be removed. If `None`
+            the entire cache is cleared.
+        :type condition: function or None
+        """
+        with self._lock:
+            if condition is None:
+                self._data.clear()
+                self._total_weight = 0
+                return
+
+            for key in [key for key in self._data if condition(key)]:
+                self._remove(key)
+
+    def get_stats(self):
+        """ Provides statistics about usage of the cache
+
+        :return: A dictionary with number of hits, misses, current number of entries and their total weight
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'weight': self._total_weight
+            }
+
+    def _get_item(self, key):
+        """ Returns a tuple of value, expiration time and weight or `None` if there is no such entry. Expired entries
+        are removed.
+        """
+        item = self._data.get(key)
+        if item is not None and self._is_expired(item):
+            self._remove(key)
+            return None
+        return item
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._total_weight -= item[2]
+        return item
+
+    def _get_expiration_time(self):
+        return None if self.ttl is None else time.monotonic() + self.ttl
+
+    @staticmethod
+    def _is_expired(item):
+        return item[1] is not None and item[1] < time.monotonic()
+
+
+class SqliteJsonCache:
+    """ A size-bounded cache of JSON-serializable values persisted in a SQLite database file. Because SQLite handles
+    locking, the cache can be shared by multiple worker processes.
+
+    When the cache is full the oldest entries are evicted.
+    """
+    def __init__(self, path, maxsize):
+        """
+        :param path: Path to the database file. Its parent folder is created if it doesn't exist.
+        :type path: str
+        :param maxsize: Maximal number of entries in the cache
+        :type maxsize: int
+        """
+        self.path = path
+        self.maxsize = maxsize
+
+        self._thread_data = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def connection(self):
+        """ A database connection of the current thread and process. It is opened only when it is needed so that it is
+        never shared with forked processes.
+        """
+        if getattr(self._thread_data, 'pid', None) != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+            self._thread_data.connection = connection
+            self._thread_data.pid = os.getpid()
+        return self._thread_data.connection
+
+    def get(self, key, default=None):
+        """ Returns a value from the cache
+        """
+        row = self.connection.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        """ Adds a value to the cache and evicts the oldest entries if the cache is full
+        """
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+            self.connection.execute('DELETE FROM cache WHERE rowid <= (SELECT MAX(rowid) FROM cache) - ?',
+                                    (self.maxsize,))
+
+    def get_stats(self):
+        """ Provides statistics about usage of the cache in the current process
+
+        :return: A dictionary with number of hits, misses and current number of entries
+        :rtype: dict
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': self.connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        }
+
+
+class NpyFileCache:
+    """ A cache of numpy arrays together with their JSON-serializable metadata persisted in a folder. Files are named
+    by a hash of the key, arrays are stored in `.npy` format and loaded as memory-mapped arrays. Files are written
+    atomically, therefore the cache can be shared by multiple worker processes.
+
+    When the total size of files exceeds the limit the least recently used entries are evicted.
+    """
+    def __init__(self, folder, max_bytes):
+        """
+        :param folder: A folder where files are stored. It is created if it doesn't exist.
+        :type folder: str
+        :param max_bytes: Maximal total size of files in bytes
+        :type max_bytes: int
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """ Returns an array and its metadata from the cache and marks the entry as recently used
+
+        :param key: A key of the entry
+        :type key: str
+        :param default: A value which is returned if the key is not in the cache
+        :return: A memory-mapped array and a dictionary of metadata
+        :rtype: (numpy.memmap, dict)
+        """
+        array_path, metadata_path = self._get_paths(key)
+        try:
+            with open(metadata_path, encoding='utf-8') as metadata_file:
+                metadata = json.load(metadata_file)
+            array = np.load(array_path, mmap_mode='r')
+            os.utime(metadata_path)
+        except (IOError, ValueError):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return array, metadata
+
+    def set(self, key, array, metadata=None):
+        """ Adds an array with its metadata to the cache and evicts the least recently used entries if the cache is
+        too large
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        array_path, metadata_path = self._get_paths(key)
+
+        temp_array_path, temp_metadata_path = get_temp_path(array_path), get_temp_path(metadata_path)
+        with open(temp_array_path, 'wb') as array_file:
+            np.save(array_file, np.asarray(array))
+        with open(temp_metadata_path, 'w', encoding='utf-8') as metadata_file:
+            json.dump(metadata or {}, metadata_file)
+
+        # Metadata file marks a complete entry, therefore it is moved last
+        os.replace(temp_array_path, array_path)
+        os.replace(temp_metadata_path, metadata_path)
+
+        self._evict()
+
+    def get_stats(self):
+        """ Provides statistics about usage of the cache in the current process
+
+        :return: A dictionary with number of hits, misses, current number of entries and their total size in bytes
+        :rtype: dict
+        """
+        entries = self._get_entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(entries),
+            'weight': sum(size for _, size, _ in entries)
+        }
+
+    def _get_paths(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, '{}.npy'.format(name)), os.path.join(self.folder, '{}.json'.format(name))
+
+    def _get_entries(self):
+        """ Provides a list of entries with their last access time, total size and paths to their files. The metadata
+        file is listed first so that an entry is never left without metadata but with an array
+        """
+        entries = []
+        for filename in os.listdir(self.folder) if os.path.isdir(self.folder) else []:
+            name, extension = os.path.splitext(filename)
+            if extension != '.json':
+                continue
+
+            metadata_path, array_path = os.path.join(self.folder, filename), os.path.join(self.folder, name + '.npy')
+            try:
+                metadata_stat = os.stat(metadata_path)
+                array_size = os.path.getsize(array_path)
+            except OSError:
+                continue
+            entries.append((metadata_stat.st_mtime, metadata_stat.st_size + array_size, [metadata_path, array_path]))
+
+        return entries
+
+    def _evict(self):
+        remove_lru_entries(self._get_entries(), self.max_bytes)
+
+
+class BlobStore:
+    """ A content-addressed store of binary blobs persisted in a folder. Each blob is stored in a file named by SHA-256
+    hash of its content, which also serves as its ID. Like `NpyFileCache` it can be shared by multiple worker processes
+    and it removes the least recently used blobs once their total size exceeds the limit.
+    """
+    def __init__(self, folder, max_bytes):
+        """
+        :param folder: A folder where blobs are stored. It is created if it doesn't exist.
+        :type folder: str
+        :param max_bytes: Maximal total size of blobs in bytes
+        :type max_bytes: int
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def put(self, data):
+        """ Adds a blob to the store
+
+        :param data: Content of the blob
+        :type data: bytes
+        :return: ID of the blob
+        :rtype: str
+        """
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self._get_path(blob_id)
+
+        if os.path.isfile(path):
+            os.utime(path)
+            return blob_id
+
+        save_file(path, data)
+
+        self._evict()
+        return blob_id
+
+    def get(self, blob_id):
+        """ Provides content of a blob and marks it as recently used
+
+        :param blob_id: ID of the blob
+        :type blob_id: str
+        :return: Content of the blob or `None` if it doesn't exist
+        :rtype: bytes or None
+        """
+        try:
+            with open(self._get_path(blob_id), 'rb') as blob_file:
+                data = blob_file.read()
+            os.utime(self._get_path(blob_id))
+        except (IOError, ValueError):
+            return None
+        return data
+
+    def _get_path(self, blob_id):
+        if len(blob_id) != 64 or not all(char in '0123456789abcdef' for char in blob_id):
+            raise ValueError('Invalid blob ID {}'.format(blob_id))
+        return os.path.join(self.folder, blob_id)
+
+    def _evict(self):
+        blobs = []
+        for filename in os.listdir(self.folder):
+            if filename.endswith('.tmp'):
+                continue
+
+            path = os.path.join(self.folder, filename)
+            try:
+                blob_stat = os.stat(path)
+            except OSError:
+                continue
+            blobs.append((blob_stat.st_mtime, blob_stat.st_size, [path]))
+
+        remove_lru_entries(blobs, self.max_bytes)
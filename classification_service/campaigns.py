@@ -2,20 +2,28 @@
 This module implements campaigns and their properties
 """
 
+import os
+import json
 import logging
+import datetime
 
 import attr
+import dateutil.parser
+import shapely.geometry
 from attr.validators import instance_of
 from marshmallow import ValidationError
 
-from sentinelhub import BBox, CRS
+from sentinelhub import BBox, CRS, Geometry
 
 from .utils import to_python
-from .sampling import Sampling, ShIndexSampling, GeopediaWaterBodySampling, GeopediaOldAppResults
+from .sampling import Sampling, ShIndexSampling, ShOgcSampling, GeopediaWaterBodySampling, GeopediaOldAppResults
+from .tile_catalogue import TileCatalogue
 from .sources import Source, SourceType, load_input_sources
 from .schemas import CampaignSchema, BasicCampaignSchema, CampaignInfoSchema
 from .users import Access
 from .utils import get_uuid
+from .cache import LruCache
+from .constants import SamplingEngine, CAMPAIGN_CACHE_DIR, S2_START_DATE, ACTIVE_TASKS_CACHE_SIZE, TASK_LEASE_TIME
 
 
 LOGGER = logging.getLogger(__name__)
@@ -33,7 +41,10 @@ class Campaign:
     output_source = attr.ib(converter=Source.load, default=None)
     ui = attr.ib(validator=instance_of(dict), factory=dict)
     active_users = attr.ib(init=False, factory=set)
-    active_tasks = attr.ib(init=False, factory=dict)
+    # Leased tasks expire together with their leases so that the cache of a long-lived campaign stays bounded
+    active_tasks = attr.ib(init=False, factory=lambda: LruCache(maxsize=ACTIVE_TASKS_CACHE_SIZE, ttl=TASK_LEASE_TIME))
+    area_of_interest = attr.ib(init=False, default=None)
+    geometry = attr.ib(init=False, default=None)
     sampling_method = attr.ib(init=False)
 
     CAMPAIGN_SCHEMA = CampaignSchema(strict=True)
@@ -48,14 +59,26 @@ class Campaign:
         if self.sampling is None:  # TODO: fixme
             return
 
-        # TODO: accept non-default geometry
-        max_coord = 2 * 10 ** 7
-        self.geometry = BBox((-max_coord, -max_coord, max_coord, max_coord), CRS.POP_WEB)
+        self.area_of_interest = self._parse_area_of_interest()
+
+        if self.area_of_interest is None:
+            max_coord = 2 * 10 ** 7
+            self.geometry = BBox((-max_coord, -max_coord, max_coord, max_coord), CRS.POP_WEB)
+        else:
+            self.geometry = self.area_of_interest.transform(CRS.POP_WEB)
 
         if self.input_source.source_type is SourceType.S2_L1C_ARCHIVE:
             window_shape = self.sampling['window_width'], self.sampling['window_height']
-            # TODO: replace ShIndexSampling with ShOgcIndexSampling
-            self.sampling_method = ShIndexSampling(window_shape, self.sampling['resolution'], self.sampling['buffer'])
+
+            if self.area_of_interest is None:
+                self.sampling_method = ShIndexSampling(window_shape, self.sampling['resolution'],
+                                                       self.sampling['buffer'], engine=self.sampling_engine,
+                                                       catalogue=TileCatalogue.load())
+            else:
+                self.sampling_method = ShOgcSampling(self.area_of_interest, self.time_interval, self.maxcc,
+                                                     window_shape, self.sampling['resolution'], self.sampling['buffer'],
+                                                     engine=self.sampling_engine,
+                                                     cache_folder=self.get_cache_folder(self.id))
 
         elif self.input_source.source_type.is_geopedia_source():
             if self.input_source.geopedia_layer == 1749:
@@ -64,12 +87,65 @@ class Campaign:
             elif self.input_source.geopedia_layer == 2048:
                 window_shape = self.sampling['window_width'], self.sampling['window_height']
                 self.sampling_method = GeopediaWaterBodySampling(self.input_source, window_shape,
-                                                                 self.sampling['resolution'])
+                                                                 self.sampling['resolution'],
+                                                                 engine=self.sampling_engine)
             else:
                 raise NotImplementedError
         else:
             raise NotImplementedError
 
+    def _parse_area_of_interest(self):
+        """ Parses area of interest from sampling configuration. When it is loaded from the store it is a JSON string
+        and its CRS can be given either as an EPSG code or in GeoJSON format.
+
+        :return: Area of interest or `None` if it is not specified
+        :rtype: sentinelhub.Geometry or None
+        """
+        aoi = self.sampling.get('aoi')
+        if not aoi:
+            return None
+
+        if isinstance(aoi, str):
+            aoi = json.loads(aoi)
+            self.sampling['aoi'] = aoi
+
+        crs = aoi.get('crs', int(CRS.WGS84.value))
+        if isinstance(crs, dict):
+            crs = crs['properties']['name'].rsplit(':', 1)[1]
+
+        return Geometry(shapely.geometry.shape(aoi), crs=CRS(str(crs)))
+
+    @property
+    def time_interval(self):
+        """ Time interval of sampled acquisitions. By default it spans the entire Sentinel-2 archive
+        """
+        time_interval = self.sampling.get('time_interval')
+        if isinstance(time_interval, str):
+            time_interval = json.loads(time_interval)
+
+        if not time_interval:
+            return [dateutil.parser.parse(S2_START_DATE), datetime.datetime.now()]
+        return [dateutil.parser.parse(timestamp) for timestamp in time_interval]
+
+    @property
+    def maxcc(self):
+        """ Maximal cloud coverage of sampled acquisitions. By default acquisitions are not filtered by cloud coverage
+        """
+        maxcc = self.sampling.get('maxcc')
+        return 1.0 if maxcc is None else float(maxcc)
+
+    @staticmethod
+    def get_cache_folder(campaign_id):
+        """ Provides a folder where precomputed sampling data of a campaign is persisted
+        """
+        return os.path.join(CAMPAIGN_CACHE_DIR, campaign_id)
+
+    @property
+    def sampling_engine(self):
+        """ Sampling engine selected for the campaign. If not specified it is chosen automatically for each geometry
+        """
+        return SamplingEngine(self.sampling.get('engine') or SamplingEngine.AUTO.value)
+
     @property
     def layers(self):
         """ A property that provides layers of output source
@@ -126,7 +202,10 @@ class Campaign:
         return self.sampling_method
 
     def add_active_task(self, task):
-        self.active_tasks[task.task_id] = task
+        self.active_tasks.set(task.task_id, task)
+
+    def remove_active_task(self, task_id):
+        self.active_tasks.pop(task_id)
 
     def get_sampling_window(self):
         return [self.sampling['window_width'], self.sampling['window_height']]
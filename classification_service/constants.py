@@ -2,6 +2,8 @@
 This module holds constants used throughout the package
 """
 
+import os
+import tempfile
 from enum import Enum
 
 
@@ -31,6 +33,14 @@ class GeopediaType(Enum):
         }[self]
 
 
+class SamplingEngine(Enum):
+    """ Engine which computes where a sampling window fits into a sampling geometry
+    """
+    VECTOR = 'vector'
+    RASTER = 'raster'
+    AUTO = 'auto'
+
+
 class PermissionType(Enum):
     PRIVATE = 0
     PUBLIC = 113
@@ -274,3 +284,69 @@ GPD_TABLE = {
 
 MAX_TASKS = 5
 MIN_TASKS = 2
+
+QUERY_CACHE_SIZE = 1000
+QUERY_CACHE_TTL = 300  # in seconds
+
+CAMPAIGN_CACHE_SIZE = 100
+CAMPAIGN_CACHE_TTL = 3600  # in seconds
+
+USER_ACCESS_CACHE_SIZE = 10000
+USER_ACCESS_CACHE_TTL = 600  # in seconds
+
+HTTP_POOL_CONNECTIONS = 10  # number of hosts
+HTTP_POOL_MAXSIZE = 20  # number of connections per host
+HTTP_POOL_RETRIES = 3  # number of retries of a request after a connection error or a server error
+HTTP_POOL_BACKOFF_FACTOR = 1  # sleep time before the n-th retry is this factor times 2 ** (n - 1) seconds
+
+TASK_WORKERS = 4  # number of threads generating tasks in the background
+TASK_POOL_SHUTDOWN_TIMEOUT = 10  # in seconds, maximal time to wait for background workers at exit
+
+TASK_LEASE_TIME = 1800  # in seconds
+ACTIVE_TASKS_CACHE_SIZE = 1000  # number of leased tasks of a single campaign kept in memory
+
+FEASIBLE_REGION_CACHE_SIZE = 1000
+FEASIBLE_REGION_CACHE_BYTES = 200 * 2 ** 20
+
+RASTER_ENGINE_VERTEX_THRESHOLD = 2000  # geometries with more vertices are sampled with raster engine
+RASTER_ENGINE_MAX_PIXELS = 10 ** 7  # larger rasters would take too much memory
+
+CACHE_DIR = os.environ.get('CLASSIFICATION_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'classification_service'))
+TILE_INFO_CACHE_SIZE = 100000
+
+S2_TILE_AREA = 12055600804.0  # area of a full Sentinel-2 tile in square meters
+MIN_TILE_COVERAGE = 0.1  # tiles with smaller coverage are never sampled
+
+TILE_CATALOGUE_PATH = os.environ.get('S2_TILE_CATALOGUE', os.path.join(CACHE_DIR, 'tile_catalogue'))
+TILE_CATALOGUE_SAMPLE_SIZE = 64  # number of tile IDs drawn from the catalogue at once
+TILE_CATALOGUE_CHUNK_SIZE = 10000  # number of tiles requested from S-2 index at once when a catalogue is built
+
+WFS_WORKERS = 8  # number of parallel WFS searches
+WFS_CACHE_SIZE = 10000
+WFS_CACHE_TTL = 86400  # in seconds, new acquisitions are found after at most a day
+WFS_GRID_CELL_DEGREES = 0.01  # size of a grid cell for caching WFS searches in WGS84
+WFS_GRID_CELL_METERS = 1000  # size of a grid cell for caching WFS searches in other CRS
+
+PROJECTED_AOI_CACHE_SIZE = 16  # number of CRS in which AOI of a single sampler is kept
+SAMPLING_REGION_CACHE_SIZE = 256  # number of tile and AOI intersections kept by a single sampler
+MAX_PRECOMPUTED_UTM_ZONES = 8  # AOI spanning more UTM zones is projected only when needed
+
+CAMPAIGN_CACHE_DIR = os.path.join(CACHE_DIR, 'campaigns')  # precomputed sampling data of each campaign
+S2_START_DATE = '2015-06-23'  # default start of campaign time interval
+
+GEOPEDIA_WORKERS = 4  # number of threads collecting pages of Geopedia layers
+GEOPEDIA_PAGE_SIZE = 100  # number of features in a page of Geopedia layer
+GEOPEDIA_READ_AHEAD_PAGES = 2  # number of pages collected in advance
+
+MASK_CACHE_DIR = os.path.join(CACHE_DIR, 'masks')  # decoded masks shared by all worker processes
+MASK_CACHE_BYTES = 2 * 2 ** 30
+MASK_CACHE_WORKERS = 2  # number of threads decoding entire downloaded masks for the cache
+
+PREFETCH_WORKERS = 8  # number of threads building tasks in advance
+PREFETCH_TASKS = 4  # number of tasks of a single sampler which are built in advance
+
+LAYER_STORE_DIR = os.path.join(CACHE_DIR, 'layers')  # encoded layers of tasks, shared by all worker processes
+LAYER_STORE_BYTES = 5 * 2 ** 30
+LAYER_MAX_AGE = 365 * 24 * 3600  # in seconds, layers never change because they are content-addressed
+
+PNG_COMPRESS_LEVEL = 6  # zlib level of encoded PNG images, higher levels are much slower but barely smaller
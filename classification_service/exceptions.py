@@ -29,6 +29,19 @@ class MissingCampaignError(CustomServiceException):
         super().__init__('Campaign with ID {} does not exist'.format(campaign_id), 404)
 
 
+class MissingTaskLayerError(CustomServiceException):
+    """ This is raised when a task or its layer with requested ID does not exist
+    """
+    def __init__(self, task_id, layer):
+        """
+        :param task_id: ID of the task
+        :type task_id: str
+        :param layer: Name of the missing layer
+        :type layer: str
+        """
+        super().__init__('Task with ID {} does not have layer {}'.format(task_id, layer), 404)
+
+
 class NotAllowedError(CustomServiceException):
     """ This is raised whenever user is not allowed to access something
     """
@@ -7,6 +7,7 @@ import io
 import copy
 import json
 import logging
+import threading
 import pkg_resources
 from configparser import RawConfigParser
 from itertools import islice
@@ -14,14 +15,17 @@ from sys import version_info
 from collections import OrderedDict
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import shapely.geometry
 import attr
 from attr.validators import instance_of
 from werkzeug.datastructures import FileStorage
 
-from sentinelhub import SHConfig, GeopediaFeatureIterator, get_json, Geometry
+from sentinelhub import SHConfig, GeopediaFeatureIterator, Geometry, DownloadFailedException
 
-from .constants import GeopediaType, GPD_FEATURE, GPD_TABLE, PermissionType
+from .constants import GeopediaType, GPD_FEATURE, GPD_TABLE, PermissionType, HTTP_POOL_CONNECTIONS, \
+    HTTP_POOL_MAXSIZE, HTTP_POOL_RETRIES, HTTP_POOL_BACKOFF_FACTOR
 
 LOGGER = logging.getLogger(__name__)
 
@@ -64,6 +68,73 @@ class GeopediaConfig:
         return dict(config_parser.items('geopedia')), dict(config_parser.items('tables'))
 
 
+class HttpConnectionPool:
+    """ A pool of keep-alive HTTP connections which is shared among threads
+
+    Requests sessions are not thread-safe, therefore each thread gets its own session. All sessions share the same
+    adapter and therefore also the same pool of open connections.
+
+    Same as downloads in `sentinelhub`, requests which fail because of a connection error or a server error are retried.
+    """
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 retries=HTTP_POOL_RETRIES):
+        """
+        :param pool_connections: Number of hosts for which connection pools are kept
+        :type pool_connections: int
+        :param pool_maxsize: Maximal number of open connections to a single host
+        :type pool_maxsize: int
+        :param retries: Maximal number of retries of a single request
+        :type retries: int
+        """
+        retry = Retry(total=retries, backoff_factor=HTTP_POOL_BACKOFF_FACTOR, status_forcelist=self.RETRY_STATUS_CODES,
+                      raise_on_status=False)
+        self._adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True,
+                                    max_retries=retry)
+        self._thread_data = threading.local()
+
+    @property
+    def session(self):
+        """ A session of the current thread
+        """
+        if not hasattr(self._thread_data, 'session'):
+            session = requests.Session()
+            session.headers['Connection'] = 'keep-alive'
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+            self._thread_data.session = session
+        return self._thread_data.session
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def get_stats(self):
+        """ Provides statistics about opened and reused connections
+
+        :return: A dictionary with number of hosts, opened connections, sent requests and requests which reused an
+            already opened connection
+        :rtype: dict
+        """
+        pools = self._adapter.poolmanager.pools
+        host_pools = [pools[key] for key in pools.keys()]
+
+        connections = sum(pool.num_connections for pool in host_pools)
+        sent_requests = sum(pool.num_requests for pool in host_pools)
+        return {
+            'hosts': len(host_pools),
+            'connections': connections,
+            'requests': sent_requests,
+            'reused': sent_requests - connections
+        }
+
+
+HTTP_POOL = HttpConnectionPool()
+
+
 @attr.s()
 class GeopediaPayloadBase:
     """ Base class for responses obtained from Geopedia
@@ -86,8 +157,12 @@ class GeopediaPayloadBase:
 @attr.s()
 class GeopediaTable(GeopediaPayloadBase):
     """ Container for basic properties of a Geopedia table
+
+    If a query cache is given, results of queries are cached and the cache is invalidated whenever something is
+    written into the table with `SaveToGeopedia`
     """
     gpd_store = attr.ib()
+    query_cache = attr.ib(default=None)
 
     def __attrs_post_init__(self):
         """ This method happens right after init
@@ -121,15 +196,21 @@ class GeopediaTable(GeopediaPayloadBase):
         return self.gpd_store.gpd_session
 
     @staticmethod
-    def load(table_id, gpd_store):
+    def load(table_id, gpd_store, query_cache=None):
         """ Load an instance of GeopediaTable
         """
         # For now we need entire gpd_store because it is keeping the session alive
         # This should be changed when session updating is fixed at Geopedia
         gpd_session = gpd_store.gpd_session
         url = '{}data/v2/tables/{}'.format(gpd_session.base_url, table_id)
-        payload = get_json(url, headers=gpd_session.session_headers)
-        return GeopediaTable(payload=payload, gpd_store=gpd_store)
+        try:
+            response = HTTP_POOL.get(url, headers=gpd_session.session_headers)
+            response.raise_for_status()
+            payload = response.json()
+        except (requests.RequestException, ValueError) as exception:
+            message = 'Failed to load Geopedia table from {}: {}'.format(url, exception)
+            raise DownloadFailedException(message) from exception
+        return GeopediaTable(payload=payload, gpd_store=gpd_store, query_cache=query_cache)
 
     def get_field_id(self, field_name):
         """ Get a field id from a field name
@@ -167,9 +248,8 @@ class GeopediaTable(GeopediaPayloadBase):
 
         field_ids = [self.get_field_id(name) for name in column_names]
         query = ' && '.join([col + expr for col, expr in zip(field_ids, conditions)])
-        gpd_iterator = GeopediaFeatureIterator(self.id, query_filter=query, gpd_session=self.gpd_session)
 
-        return self._return_query_results(gpd_iterator, query, return_all)
+        return self._return_query_results(query, return_all)
 
     def query_rows(self, row_ids):
         """ The method makes a query to Geopedia table for specified rows. It returns table content for those rows.
@@ -186,19 +266,46 @@ class GeopediaTable(GeopediaPayloadBase):
         row_ids = row_ids if return_all else [row_ids]
 
         query = ' || '.join(['id{} = {}'.format(self.id, row_id) for row_id in row_ids])
-        gpd_iterator = GeopediaFeatureIterator(self.id, query_filter=query, gpd_session=self.gpd_session)
 
-        return self._return_query_results(gpd_iterator, query, return_all)
+        return self._return_query_results(query, return_all)
 
-    def _return_query_results(self, gpd_iterator, query, return_all):
+    def invalidate_cache(self):
+        """ Removes all cached query results of this table
+        """
+        if self.query_cache is not None:
+            self.query_cache.invalidate(lambda key: key[0] == self.id)
+
+    def _return_query_results(self, query, return_all):
         """ Helper method for returning 1 or all results of a query to Geopedia table
         """
+        results = [GeopediaRowData(result) for result in self._query_payloads(query, return_all)]
+
         if return_all:
-            return [GeopediaRowData(result) for result in gpd_iterator]
-        try:
-            return GeopediaRowData(next(gpd_iterator))
-        except StopIteration:
+            return results
+        if not results:
             raise RuntimeError("There are no items for query '{}' in table '{}'".format(query, self.name))
+        return results[0]
+
+    def _query_payloads(self, query, return_all):
+        """ Collects payloads of features satisfying the query either from the cache or from Geopedia. Because
+        results are modified by the caller, the cached payloads are always copied.
+
+        Empty results are not cached because a missing row (e.g. a new user) could be added by another process at any
+        time and this process would only see it after the cache entry expires.
+        """
+        cache_key = self.id, query, return_all
+        if self.query_cache is not None:
+            payloads = self.query_cache.get(cache_key)
+            if payloads is not None:
+                return copy.deepcopy(payloads)
+
+        gpd_iterator = GeopediaFeatureIterator(self.id, query_filter=query, gpd_session=self.gpd_session)
+        payloads = list(gpd_iterator) if return_all else list(islice(gpd_iterator, 1))
+
+        if self.query_cache is not None and payloads:
+            self.query_cache.set(cache_key, payloads)
+            return copy.deepcopy(payloads)
+        return payloads
 
 
 @attr.s()
@@ -236,9 +343,10 @@ class GeopediaRowData(GeopediaPayloadBase):
 
 class SaveToGeopedia:
 
-    def __init__(self, gpd_tables, session_id):
+    def __init__(self, gpd_tables, session_id, http_pool=HTTP_POOL):
         self.gpd_tables = gpd_tables
         self.session_id = session_id
+        self.http_pool = http_pool
 
         self.base_url = '{}'.format(SHConfig().geopedia_rest_url)
 
@@ -265,10 +373,10 @@ class SaveToGeopedia:
         if needs_ordered_dicts() and data is not None:
             data = self._apply_ordered_dicts(data)
 
-        response = requests.post(url=request_url,
-                                 data=data if data is None else json.dumps(data),
-                                 headers=self._get_headers(is_json=is_json, session_id=session_id),
-                                 files=files)
+        response = self.http_pool.post(request_url,
+                                       data=data if data is None else json.dumps(data),
+                                       headers=self._get_headers(is_json=is_json, session_id=session_id),
+                                       files=files)
 
         LOGGER.info('Sampling table - POST: Response: %s, Status: %d', response.reason, response.status_code)
         try:
@@ -358,12 +466,20 @@ class SaveToGeopedia:
         return feature
 
     def save_feature(self, table_name, values_dict):
-        return self._send_json('{}data/v1/features/save'.format(self.base_url),
-                               data=self._set_feature(self.gpd_tables[table_name], values_dict))
+        table = self.gpd_tables[table_name]
+        try:
+            return self._send_json('{}data/v1/features/save'.format(self.base_url),
+                                   data=self._set_feature(table, values_dict))
+        finally:
+            table.invalidate_cache()
 
     def update_feature(self, table_name, values_dict, row_id):
-        return self._send_json('{}data/v1/features/save'.format(self.base_url),
-                               data=self._update_feature(self.gpd_tables[table_name], values_dict, row_id))
+        table = self.gpd_tables[table_name]
+        try:
+            return self._send_json('{}data/v1/features/save'.format(self.base_url),
+                                   data=self._update_feature(table, values_dict, row_id))
+        finally:
+            table.invalidate_cache()
 
     def save_files(self, table, values_dict, files):
         files['feature'] = FileStorage(io.StringIO(json.dumps(self._set_feature(table,
@@ -389,10 +505,34 @@ class SaveToGeopedia:
                                session_id=user_session_id, data=gpd_table)
 
 
-def get_layer_item_list(layer, interval=None):
-    if interval:
-        list(islice(GeopediaFeatureIterator(layer), *interval))
-    return list(GeopediaFeatureIterator(layer))
+def get_layer_item_list(layer, after_id=None, limit=None):
+    """ Collects features of a Geopedia layer, which are ordered by their IDs. Geopedia feature iterator doesn't
+    support an offset, therefore features are paged with a filter on feature ID which is evaluated by Geopedia.
+
+    :param layer: Geopedia layer ID
+    :type layer: int
+    :param after_id: If given only features with a larger ID are collected
+    :type after_id: int or None
+    :param limit: Maximal number of collected features. By default all features are collected.
+    :type limit: int or None
+    :return: A list of features
+    :rtype: list(dict)
+    """
+    query_filter = None if after_id is None else 'id{} > {}'.format(layer, after_id)
+    gpd_iterator = GeopediaFeatureIterator(layer, query_filter=query_filter)
+
+    return list(gpd_iterator if limit is None else islice(gpd_iterator, limit))
+
+
+def get_feature_id(feature):
+    """ Provides ID of a feature collected from a Geopedia layer
+
+    :param feature: A feature
+    :type feature: dict
+    :return: Feature ID
+    :rtype: int
+    """
+    return int(feature['@id'].rsplit('/', 1)[1])
 
 
 def needs_ordered_dicts():
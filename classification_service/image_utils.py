@@ -4,21 +4,77 @@ Module containing utils for processing images
 
 import base64
 import io
+import zlib
+import struct
 import numpy as np
 
 from PIL import Image
 
+from .constants import PNG_COMPRESS_LEVEL
+
 
 MASK_THRESHOLD = 100
 
 
 def merge_images(images, colors):
-    merged_image = np.zeros(images[0].shape[:2] + (3,), dtype=np.uint8)
+    return merge_images_with_palette(images, build_palette(colors))
+
+
+def merge_images_with_palette(images, palette, class_indices=None):
+    """ Merges masks of classes into a single RGB image. If multiple masks cover the same pixel the later one wins.
+
+    :param images: Mask images of classes, a pixel belongs to a class if its first channel is at least MASK_THRESHOLD
+    :type images: list(numpy.ndarray)
+    :param palette: A lookup table of colors, as created by `build_palette`
+    :type palette: numpy.ndarray
+    :param class_indices: Indices of classes in the palette, by default masks are of classes 1, 2, ...
+    :type class_indices: list(int) or None
+    :return: An RGB image
+    :rtype: numpy.ndarray
+    """
+    masks = [image[..., 0] >= MASK_THRESHOLD for image in images]
+    return np.take(palette, get_class_index(masks, class_indices), axis=0)
+
+
+def get_class_index(masks, class_indices=None):
+    """ Computes which class wins in each pixel in a single vectorized pass. If multiple masks cover the same pixel the
+    later one wins.
+
+    :param masks: Boolean masks of classes
+    :type masks: list(numpy.ndarray)
+    :param class_indices: Indices of classes, by default masks are of classes 1, 2, ...
+    :type class_indices: list(int) or None
+    :return: An array of class indices, where 0 means that no mask covers the pixel
+    :rtype: numpy.ndarray of type numpy.uint8
+    """
+    if len(masks) > 255:
+        raise ValueError('At most 255 classes can be merged, got {}'.format(len(masks)))
 
-    for image, color in zip(images, colors):
-        merged_image[image[..., 0] >= MASK_THRESHOLD, :] = hex_to_rgb(color)
+    # Each mask is multiplied by its position, therefore the maximum is the position of the last mask covering a pixel
+    positions = np.stack(masks).view(np.uint8)
+    positions *= np.arange(1, len(masks) + 1, dtype=np.uint8)[:, np.newaxis, np.newaxis]
+    last_positions = positions.max(axis=0)
 
-    return merged_image
+    if class_indices is None:
+        return last_positions
+
+    index_lut = np.array([0] + list(class_indices), dtype=np.uint8)
+    return np.take(index_lut, last_positions)
+
+
+def build_palette(colors):
+    """ Builds a lookup table of colors which maps class indices to RGB values. Index 0 is a black background
+
+    :param colors: Hex colors of classes 1, 2, ...
+    :type colors: list(str)
+    :return: An array of shape (len(colors) + 1, 3)
+    :rtype: numpy.ndarray of type numpy.uint8
+    """
+    palette = np.zeros((len(colors) + 1, 3), dtype=np.uint8)
+    for index, color in enumerate(colors, start=1):
+        palette[index] = hex_to_rgb(color)
+
+    return palette
 
 
 def hex_to_rgb(hex_color):
@@ -26,7 +82,7 @@ def hex_to_rgb(hex_color):
     return np.array(list(int(hex_color[i: i + 2], 16) for i in (0, 2, 4)))
 
 
-def encode_image(np_image):
+def encode_image(np_image, compress_level=PNG_COMPRESS_LEVEL):
     """ Transforms numpy image into bytes
     """
     if np_image.dtype != np.uint8:
@@ -41,5 +97,272 @@ def encode_image(np_image):
 
     image = Image.fromarray(np_image, 'RGB' if channels == 3 else 'RGBA')
     bio = io.BytesIO()
-    image.save(bio, format='png')
+    image.save(bio, format='png', compress_level=compress_level)
     return base64.b64encode(bio.getvalue()).decode('utf-8')
+
+
+def encode_indexed_png(class_index, palette, transparent_background=False, compress_level=PNG_COMPRESS_LEVEL):
+    """ Transforms an array of class indices into bytes of an 8-bit palette PNG, which is much smaller and faster to
+    encode than an RGB PNG
+
+    :param class_index: An array of class indices, as created by `get_class_index`
+    :type class_index: numpy.ndarray of type numpy.uint8
+    :param palette: A lookup table of colors, as created by `build_palette`
+    :type palette: numpy.ndarray
+    :param transparent_background: If `True` pixels of class 0 will be transparent
+    :type transparent_background: bool
+    :param compress_level: PNG compression level between 0 and 9
+    :type compress_level: int
+    :return: Bytes of PNG image
+    :rtype: bytes
+    """
+    if class_index.dtype != np.uint8 or class_index.ndim != 2:
+        raise ValueError('Class index must be a 2-dimensional numpy array of type numpy.uint8')
+    if len(palette) > 256:
+        raise ValueError('Palette can have at most 256 colors, got {}'.format(len(palette)))
+
+    image = Image.fromarray(class_index, 'P')
+    image.putpalette(np.asarray(palette, dtype=np.uint8).flatten().tolist())
+
+    save_params = {'transparency': 0} if transparent_background else {}
+    bio = io.BytesIO()
+    image.save(bio, format='png', compress_level=compress_level, **save_params)
+    return bio.getvalue()
+
+
+class GeoTiff:
+    """ A reader of GeoTIFF images which parses tags once and decodes only those strips or tiles of the image which
+    intersect a requested window. Images with a layout which is not supported by the reader are decoded entirely with
+    PIL instead.
+    """
+    TAG_IDS = {
+        256: 'ImageWidth',
+        257: 'ImageLength',
+        258: 'BitsPerSample',
+        259: 'Compression',
+        273: 'StripOffsets',
+        277: 'SamplesPerPixel',
+        278: 'RowsPerStrip',
+        279: 'StripByteCounts',
+        284: 'PlanarConfiguration',
+        317: 'Predictor',
+        322: 'TileWidth',
+        323: 'TileLength',
+        324: 'TileOffsets',
+        325: 'TileByteCounts',
+        339: 'SampleFormat',
+        33550: 'ModelPixelScaleTag',
+        33922: 'ModelTiepointTag',
+        34737: 'GeoAsciiParamsTag'
+    }
+    TYPE_FORMATS = {1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'II', 6: 'b', 7: 'B', 8: 'h', 9: 'i', 10: 'ii', 11: 'f',
+                    12: 'd', 16: 'Q'}
+    SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+
+    NO_COMPRESSION = 1
+    DEFLATE_COMPRESSIONS = (8, 32946)
+    PACKBITS_COMPRESSION = 32773
+
+    def __init__(self, data):
+        """
+        :param data: Content of a TIFF file
+        :type data: bytes
+        """
+        self.data = data
+
+        byte_order = data[:2]
+        if byte_order not in (b'II', b'MM'):
+            raise ValueError('Data is not in TIFF format')
+        self.byte_order = '<' if byte_order == b'II' else '>'
+
+        magic_number, ifd_offset = struct.unpack(self.byte_order + 'HI', data[2:8])
+        if magic_number != 42:
+            raise ValueError('Only classic TIFF format is supported')
+
+        self.tags = self._parse_tags(ifd_offset)
+
+        self.width = self.tags['ImageWidth'][0]
+        self.height = self.tags['ImageLength'][0]
+
+    def _parse_tags(self, ifd_offset):
+        """ Parses tags of the first image file directory
+        """
+        tags = {}
+
+        n_entries, = struct.unpack(self.byte_order + 'H', self.data[ifd_offset: ifd_offset + 2])
+        for entry_index in range(n_entries):
+            entry_offset = ifd_offset + 2 + 12 * entry_index
+            tag_id, tag_type, count = struct.unpack(self.byte_order + 'HHI', self.data[entry_offset: entry_offset + 8])
+
+            if tag_id not in self.TAG_IDS or tag_type not in self.TYPE_FORMATS:
+                continue
+
+            value_format = self.TYPE_FORMATS[tag_type]
+            value_format = '{}{}{}'.format(self.byte_order, len(value_format) * count, value_format[0])
+            value_size = struct.calcsize(value_format)
+
+            value_offset = entry_offset + 8
+            if value_size > 4:
+                value_offset, = struct.unpack(self.byte_order + 'I', self.data[value_offset: value_offset + 4])
+
+            values = struct.unpack(value_format, self.data[value_offset: value_offset + value_size])
+            if tag_type == 2:
+                values = (values[0].rstrip(b'\x00').decode('ascii'),)
+            elif tag_type in (5, 10):
+                values = tuple(numerator / denominator for numerator, denominator in zip(values[::2], values[1::2]))
+
+            tags[self.TAG_IDS[tag_id]] = values
+
+        return tags
+
+    @property
+    def transform(self):
+        """ Geo-transform of the image in GDAL format
+        """
+        tiepoint, pixel_scale = self.tags['ModelTiepointTag'], self.tags['ModelPixelScaleTag']
+        return tiepoint[3], pixel_scale[0], 0.0, tiepoint[4], 0.0, -pixel_scale[1]
+
+    @property
+    def geo_ascii_params(self):
+        return self.tags.get('GeoAsciiParamsTag', ('',))[0]
+
+    @property
+    def is_supported(self):
+        """ Checks if the reader can decode the image by itself
+        """
+        bits_per_sample = set(self.tags.get('BitsPerSample', (1,)))
+        sample_format = self.tags.get('SampleFormat', (1,))[0]
+        predictor = self.tags.get('Predictor', (1,))[0]
+        compression = self.tags.get('Compression', (self.NO_COMPRESSION,))[0]
+
+        return len(bits_per_sample) == 1 and bits_per_sample.pop() in (8, 16, 32, 64) and \
+            sample_format in self.SAMPLE_FORMATS and \
+            (predictor == 1 or (predictor == 2 and sample_format != 3)) and \
+            compression in (self.NO_COMPRESSION, self.PACKBITS_COMPRESSION) + self.DEFLATE_COMPRESSIONS and \
+            (self.samples_per_pixel == 1 or self.tags.get('PlanarConfiguration', (1,))[0] == 1) and \
+            ('TileOffsets' in self.tags or 'StripOffsets' in self.tags)
+
+    @property
+    def samples_per_pixel(self):
+        return self.tags.get('SamplesPerPixel', (1,))[0]
+
+    @property
+    def dtype(self):
+        sample_format = self.SAMPLE_FORMATS[self.tags.get('SampleFormat', (1,))[0]]
+        return np.dtype('{}{}{}'.format(self.byte_order, sample_format, self.tags['BitsPerSample'][0] // 8))
+
+    def read(self, window=None):
+        """ Decodes a window of the image
+
+        :param window: Pixel window given as start and stop row and start and stop column. By default the entire image
+            is decoded.
+        :type window: (int, int, int, int) or None
+        :return: Decoded window of the image
+        :rtype: numpy.ndarray
+        """
+        row_start, row_stop, col_start, col_stop = window or (0, self.height, 0, self.width)
+        row_start, col_start = max(row_start, 0), max(col_start, 0)
+        row_stop, col_stop = min(row_stop, self.height), min(col_stop, self.width)
+
+        if not self.is_supported:
+            with Image.open(io.BytesIO(self.data)) as image:
+                return np.array(image)[row_start: row_stop, col_start: col_stop, ...]
+
+        image = np.zeros((max(row_stop - row_start, 0), max(col_stop - col_start, 0), self.samples_per_pixel),
+                         dtype=self.dtype.newbyteorder('='))
+
+        for chunk_index, (chunk_row, chunk_col, chunk_height, chunk_width) in enumerate(self._get_chunks()):
+            top, bottom = max(chunk_row, row_start), min(chunk_row + chunk_height, row_stop)
+            left, right = max(chunk_col, col_start), min(chunk_col + chunk_width, col_stop)
+            if top >= bottom or left >= right:
+                continue
+
+            chunk = self._decode_chunk(chunk_index, chunk_height, chunk_width)
+            image[top - row_start: bottom - row_start, left - col_start: right - col_start] = \
+                chunk[top - chunk_row: bottom - chunk_row, left - chunk_col: right - chunk_col]
+
+        return image[..., 0] if self.samples_per_pixel == 1 else image
+
+    def _get_chunks(self):
+        """ Provides positions and shapes of all tiles or strips of the image in the order they are stored
+        """
+        if 'TileOffsets' in self.tags:
+            tile_width, tile_height = self.tags['TileWidth'][0], self.tags['TileLength'][0]
+            return [(row, col, tile_height, tile_width) for row in range(0, self.height, tile_height)
+                    for col in range(0, self.width, tile_width)]
+
+        rows_per_strip = min(self.tags.get('RowsPerStrip', (self.height,))[0], self.height)
+        return [(row, 0, min(rows_per_strip, self.height - row), self.width)
+                for row in range(0, self.height, rows_per_strip)]
+
+    def _decode_chunk(self, chunk_index, chunk_height, chunk_width):
+        """ Decompresses a single tile or strip and reverts its predictor
+        """
+        offsets_tag, byte_counts_tag = ('TileOffsets', 'TileByteCounts') if 'TileOffsets' in self.tags else \
+            ('StripOffsets', 'StripByteCounts')
+        offset = self.tags[offsets_tag][chunk_index]
+        data = self.data[offset: offset + self.tags[byte_counts_tag][chunk_index]]
+
+        compression = self.tags.get('Compression', (self.NO_COMPRESSION,))[0]
+        if compression in self.DEFLATE_COMPRESSIONS:
+            data = zlib.decompress(data)
+        elif compression == self.PACKBITS_COMPRESSION:
+            data = unpack_bits(data)
+
+        shape = chunk_height, chunk_width, self.samples_per_pixel
+        chunk = np.frombuffer(data, dtype=self.dtype, count=int(np.prod(shape))).reshape(shape)
+
+        if self.tags.get('Predictor', (1,))[0] == 2:
+            chunk = np.cumsum(chunk, axis=1, dtype=chunk.dtype)
+
+        return chunk
+
+
+class GeoRaster:
+    """ An already decoded geo-referenced image which provides the same interface as GeoTiff
+    """
+    def __init__(self, image, transform, geo_ascii_params=''):
+        """
+        :param image: Decoded image, it can also be a memory-mapped array
+        :type image: numpy.ndarray
+        :param transform: Geo-transform of the image in GDAL format
+        :type transform: tuple(float)
+        :param geo_ascii_params: GeoTIFF ASCII parameters which describe CRS
+        :type geo_ascii_params: str
+        """
+        self.image = image
+        self.transform = tuple(transform)
+        self.geo_ascii_params = geo_ascii_params
+
+        self.height, self.width = image.shape[:2]
+
+    def read(self, window=None):
+        """ Reads a window of the image into memory
+
+        :param window: Pixel window given as start and stop row and start and stop column. By default the entire image
+            is read.
+        :type window: (int, int, int, int) or None
+        :return: A window of the image
+        :rtype: numpy.ndarray
+        """
+        row_start, row_stop, col_start, col_stop = window or (0, self.height, 0, self.width)
+        return np.array(self.image[max(row_start, 0): row_stop, max(col_start, 0): col_stop, ...])
+
+
+def unpack_bits(data):
+    """ Decompresses data compressed with PackBits algorithm
+    """
+    result = bytearray()
+    index = 0
+    while index < len(data):
+        header = data[index]
+        index += 1
+
+        if header < 128:
+            result.extend(data[index: index + header + 1])
+            index += header + 1
+        elif header > 128:
+            result.extend(data[index: index + 1] * (257 - header))
+            index += 1
+
+    return bytes(result)
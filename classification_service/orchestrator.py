@@ -2,13 +2,19 @@
 This module implements tools for selecting next task for user of Classification App
 """
 
+import copy
+import shutil
 import logging
+import threading
+
+from sentinelhub import DownloadFailedException
 
 from .campaigns import Campaign
 from .sources import load_input_sources
-from .tasks import TaskThreading
-from .constants import MIN_TASKS
-from .exceptions import NotAllowedError
+from .tasks import TaskGenerationPool, TaskQueue, LAYER_STORE
+from .cache import LruCache
+from .constants import MIN_TASKS, CAMPAIGN_CACHE_SIZE, CAMPAIGN_CACHE_TTL, TASK_POOL_SHUTDOWN_TIMEOUT
+from .exceptions import NotAllowedError, MissingTaskLayerError
 
 LOGGER = logging.getLogger(__name__)
 
@@ -39,6 +45,12 @@ class Orchestrator:
         self._store_params = kwargs
 
         self._store = None
+        self._task_pool = TaskGenerationPool(interval=.300)
+        self._task_queues = {}
+        self._task_queues_lock = threading.Lock()
+
+        # Campaigns are kept in memory together with their sampling objects and their precomputed state
+        self._campaign_cache = LruCache(maxsize=CAMPAIGN_CACHE_SIZE, ttl=CAMPAIGN_CACHE_TTL)
 
     @property
     def store(self):
@@ -81,7 +93,10 @@ class Orchestrator:
         if not allow_new_user and not has_access:
             raise NotAllowedError
 
-        campaign = self.store.get_campaign(campaign_id)
+        # The cached campaign is shared between requests, therefore user-specific UI settings are set on a copy. The
+        # copy is shallow on purpose, active tasks are shared between all requests of the campaign.
+        campaign = copy.copy(self._get_cached_campaign(campaign_id))
+        campaign.ui = dict(campaign.ui)
 
         if not has_access and add_new_user:
             self.store.add_access(campaign_id, user_id)
@@ -90,6 +105,15 @@ class Orchestrator:
 
         return campaign
 
+    def _get_cached_campaign(self, campaign_id):
+        """ Get a campaign from the cache or load it from the store
+        """
+        campaign = self._campaign_cache.get(campaign_id)
+        if campaign is None:
+            campaign = self.store.get_campaign(campaign_id)
+            self._campaign_cache.set(campaign_id, campaign)
+        return campaign
+
     def get_available_campaigns(self, user_id):
         """ Get list of available campaigns to the specific user
         """
@@ -107,6 +131,10 @@ class Orchestrator:
             return 403
 
         self.store.delete_campaign(campaign_id)
+        self._campaign_cache.pop(campaign_id)
+        shutil.rmtree(Campaign.get_cache_folder(campaign_id), ignore_errors=True)
+        with self._task_queues_lock:
+            self._task_queues.pop(campaign_id, None)
         return 200
 
     def add_campaign(self, campaign_payload, user_id, user_session_id):
@@ -116,9 +144,9 @@ class Orchestrator:
         campaign = Campaign.load(campaign_payload)
 
         self.store.add_campaign(campaign, user_session_id)
+        self._campaign_cache.set(campaign.id, campaign)
 
-        thread = TaskThreading(campaign, self.store, interval=.300)
-        thread.start()
+        self._task_pool.submit(campaign, self.store, self._get_task_queue(campaign.id))
 
         return campaign
 
@@ -126,24 +154,96 @@ class Orchestrator:
         """ Compute a task for the given campaign and save to store """
         return self.store.add_task(campaign)
 
-    def get_task(self, campaign):
-        """ Retrieve a task from the store """
-        current_task, n_tasks_left = self.store.get_task(campaign)
+    def _get_task_queue(self, campaign_id):
+        """ Get a queue of prefetched tasks of a campaign. A new queue is filled with tasks which already exist in the
+        store but haven't been done yet, e.g. tasks created by another process or before a restart.
+        """
+        with self._task_queues_lock:
+            if campaign_id not in self._task_queues:
+                self._task_queues[campaign_id] = self._load_task_queue(campaign_id)
+            return self._task_queues[campaign_id]
+
+    def _load_task_queue(self, campaign_id):
+        """ Creates a queue of a campaign with undone tasks from the store """
+        task_queue = TaskQueue()
+        try:
+            undone_tasks = self.store.get_undone_tasks(campaign_id)
+        except (RuntimeError, DownloadFailedException) as exception:
+            LOGGER.warning('Could not load undone tasks of campaign %s: %s', campaign_id, str(exception))
+            return task_queue
+
+        for task in undone_tasks:
+            task_queue.put(task, is_verified=False)
+        LOGGER.debug('Loaded %d undone tasks of campaign %s', len(undone_tasks), campaign_id)
+        return task_queue
+
+    def _lease_task(self, task_queue, user_id):
+        """ Leases a task from the queue which hasn't been done in the meantime by another process. Only tasks which
+        are not verified are checked in the store, tasks created by this process are leased without any requests.
+        """
+        while True:
+            task = task_queue.lease(user_id)
+            if task is None or task_queue.is_verified(task.task_id):
+                return task
+
+            if not self.store.is_task_done(task.task_id):
+                task_queue.set_verified(task.task_id)
+                return task
 
-        # no tasks available on geopedia, compute one and push
+            LOGGER.debug('Task %s has already been done', task.task_id)
+            task_queue.complete(task.task_id)
+
+    def get_task(self, campaign, user_id):
+        """ Lease a prefetched task to a user """
+        task_queue = self._get_task_queue(campaign.id)
+        current_task = self._lease_task(task_queue, user_id)
+
+        # no prefetched tasks available, compute one and push
         if current_task is None:
             current_task = self.store.add_task(campaign)
-            n_tasks_left = 1
+            task_queue.add_lease(current_task, user_id)
 
         campaign.add_active_task(current_task)
 
-        if n_tasks_left <= MIN_TASKS:
-            thread = TaskThreading(campaign, self.store, interval=.300)
-            thread.start()
+        if len(task_queue) <= MIN_TASKS:
+            self._task_pool.submit(campaign, self.store, task_queue)
 
         return current_task
 
+    def get_task_layer(self, campaign, task_id, layer):
+        """ Provides an image of a task layer together with its ID in the layer store. Tasks which are currently active
+        are found in memory. If a task is not active or its image has been evicted from the layer store, the task is
+        loaded from the store, which puts its images back into the layer store.
+
+        :return: Image ID and bytes of PNG image
+        :rtype: (str, bytes)
+        :raises: MissingTaskLayerError if the campaign has no such task or the task has no such layer
+        """
+        task = campaign.active_tasks.get(task_id)
+        image_id = None if task is None else task.get_layer_image_id(layer)
+        image = None if image_id is None else LAYER_STORE.get(image_id)
+
+        if image is None:
+            task = self.store.get_task(task_id, campaign.id)
+            image_id = None if task is None else task.get_layer_image_id(layer)
+            image = None if image_id is None else LAYER_STORE.get(image_id)
+
+        if image is None:
+            raise MissingTaskLayerError(task_id, layer)
+        return image_id, image
+
     def save_task(self, task_id, user_id, campaign, request):
         """ Save result of a task to store """
-        return self.store.save_task(task_id, user_id, campaign, request)
+        is_saved = self.store.save_task(task_id, user_id, campaign, request)
+        self._get_task_queue(campaign.id).complete(task_id)
+        campaign.remove_active_task(task_id)
+        return is_saved
+
+    def get_task_queue_depth(self):
+        """ Number of campaigns waiting for background generation of tasks """
+        return self._task_pool.queue_depth
+
+    def shutdown(self, timeout=TASK_POOL_SHUTDOWN_TIMEOUT):
+        """ Stop background generation of tasks and wait at most `timeout` seconds for running jobs """
+        self._task_pool.shutdown(timeout=timeout)
 
@@ -2,33 +2,65 @@
 This module contains different data sampling methods
 """
 
+import os
 import logging
 import random
+import threading
 import datetime
 import math
 from abc import ABC, abstractmethod
 from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import shapely.affinity
 import shapely.geometry
 import shapely.ops
+import shapely.prepared
+import shapely.wkb
 import dateutil.parser
 import numpy as np
 
-from PIL import Image
-from PIL.TiffTags import TAGS
+from sentinelhub import get_json, read_data, BBox, CRS, download_data, DownloadRequest, MimeType, \
+    WebFeatureService, DataSource, Geometry
 
-from sentinelhub import get_json, BBox, CRS, download_data, DownloadRequest, MimeType, WebFeatureService, \
-    DataSource, Geometry
+from .tasks import Task, LAYER_STORE
+from .sampling_utils import random_sample, random_sample_windows, random_sample_image, sample_image_with_bbox, \
+    count_points, triangulate, random_sample_point, select_sampling_engine, AreaSampler, get_window_coords, \
+    get_window_bbox
+from .geopedia import get_layer_item_list, get_feature_id
+from .image_utils import get_class_index, encode_indexed_png, build_palette, GeoTiff, GeoRaster, MASK_THRESHOLD
+from .cache import LruCache, SqliteJsonCache, NpyFileCache, save_file
+from .constants import SamplingEngine, CACHE_DIR, TILE_INFO_CACHE_SIZE, S2_TILE_AREA, MIN_TILE_COVERAGE, \
+    TILE_CATALOGUE_SAMPLE_SIZE, WFS_WORKERS, WFS_CACHE_SIZE, WFS_CACHE_TTL, WFS_GRID_CELL_DEGREES, \
+    WFS_GRID_CELL_METERS, PROJECTED_AOI_CACHE_SIZE, SAMPLING_REGION_CACHE_SIZE, MAX_PRECOMPUTED_UTM_ZONES, \
+    GEOPEDIA_WORKERS, GEOPEDIA_PAGE_SIZE, GEOPEDIA_READ_AHEAD_PAGES, MASK_CACHE_DIR, MASK_CACHE_BYTES, \
+    MASK_CACHE_WORKERS, PREFETCH_WORKERS, PREFETCH_TASKS
 
-from .tasks import Task
-from .sampling_utils import random_sample, random_sample_image, sample_image_with_bbox, \
-    get_resolution, count_points, triangulate, random_sample_point
-from .geopedia import get_layer_item_list
-from .image_utils import merge_images, encode_image, hex_to_rgb
 
+# This can also be a local folder with files <tile id>.json, which then replaces the index service
+BASE_INDEX_URL = os.environ.get('S2_INDEX_URL', 'https://services.sentinel-hub.com/index/s2/v3/tiles/')
 
-BASE_INDEX_URL = 'https://services.sentinel-hub.com/index/s2/v3/tiles/'
+# Only these fields of tile info are used and therefore cached
+TILE_INFO_FIELDS = ['coverArea', 'coverGeometry', 'tileOrigin', 'sensingTime', 'pdiId']
+TILE_INFO_CACHE = SqliteJsonCache(os.path.join(CACHE_DIR, 'tile_info.sqlite'), maxsize=TILE_INFO_CACHE_SIZE)
+
+# WFS searches of all samplers run in this pool and their results are cached per grid cell, time interval and maxcc
+WFS_EXECUTOR = ThreadPoolExecutor(max_workers=WFS_WORKERS)
+WFS_CACHE = LruCache(maxsize=WFS_CACHE_SIZE, ttl=WFS_CACHE_TTL)
+
+# Decoded mask images, keyed by their object path in Geopedia
+MASK_CACHE = NpyFileCache(MASK_CACHE_DIR, max_bytes=MASK_CACHE_BYTES)
+
+# Downloaded masks are decoded and cached in this pool so that a task waits only for decoding of its own window
+MASK_CACHE_EXECUTOR = ThreadPoolExecutor(max_workers=MASK_CACHE_WORKERS)
+
+# Pages of Geopedia layer features are read ahead in this pool
+GEOPEDIA_EXECUTOR = ThreadPoolExecutor(max_workers=GEOPEDIA_WORKERS)
+
+# Tasks which need data of multiple features are built in advance in this pool. It must be separate from the pool
+# above because building a task waits for pages of features.
+PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -62,7 +94,8 @@ class Sampling(ABC):
 
 class SentinelHubSampling(Sampling):
 
-    def __init__(self, window_shape, resolution, buffer=10, data_source=DataSource.SENTINEL2_L1C):
+    def __init__(self, window_shape, resolution, buffer=10, data_source=DataSource.SENTINEL2_L1C,
+                 engine=SamplingEngine.AUTO):
         """
         :param window_shape: Shape of the sampling window in pixels
         :type window_shape: (int, int)
@@ -72,6 +105,8 @@ class SentinelHubSampling(Sampling):
         :type buffer: int
         :param data_source: Source of satellite data
         :type data_source: sentinelhub.DataSource
+        :param engine: Engine which computes where sampling windows fit into the sampling geometry
+        :type engine: SamplingEngine or str
         """
         super().__init__()
 
@@ -79,6 +114,7 @@ class SentinelHubSampling(Sampling):
         self.resolution = resolution
         self.buffer = buffer
         self.data_source = data_source
+        self.engine = SamplingEngine(engine)
 
     def __next__(self):
         attempts = 16
@@ -102,15 +138,28 @@ class SentinelHubSampling(Sampling):
         :param area_geometry: Geometry object which has to be in UTM CRS
         :type area_geometry: sentinelhub.Geometry
         """
+        return self.get_random_bboxes(area_geometry, 1)[0]
+
+    def get_random_bboxes(self, area_geometry, n_bboxes):
+        """ Samples multiple candidate bounding boxes at once
+
+        :param area_geometry: Geometry object which has to be in UTM CRS
+        :type area_geometry: sentinelhub.Geometry
+        :param n_bboxes: Number of bounding boxes to sample
+        :type n_bboxes: int
+        :return: A list of at most `n_bboxes` bounding boxes
+        :rtype: list(sentinelhub.BBox)
+        """
         if not CRS.is_utm(area_geometry.crs):
             raise ValueError('Geometry object has to be in UTM CRS for sampling')
 
         reduced_geo = self._expand_geo_shape(area_geometry.geometry, 1 / self.resolution)
-        sampled_rectangle = random_sample(reduced_geo, (self.window_shape[0] + 2 * self.buffer,
-                                                        self.window_shape[1] + 2 * self.buffer))
-        expanded_rectangle = self._expand_geo_shape(sampled_rectangle, self.resolution)
+        sampled_rectangles = random_sample_windows(reduced_geo, (self.window_shape[0] + 2 * self.buffer,
+                                                                 self.window_shape[1] + 2 * self.buffer), n_bboxes,
+                                                   engine=self.engine)
 
-        return BBox(expanded_rectangle.bounds, crs=area_geometry.crs)
+        return [BBox(self._expand_geo_shape(rectangle, self.resolution).bounds, crs=area_geometry.crs)
+                for rectangle in sampled_rectangles]
 
     @abstractmethod
     def get_random_tile(self):
@@ -131,38 +180,75 @@ class SentinelHubSampling(Sampling):
 
 class ShIndexSampling(SentinelHubSampling):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, catalogue=None, **kwargs):
+        """
+        :param catalogue: A catalogue of tiles with enough coverage. If it is given tiles are sampled from it directly,
+            otherwise they are sampled from S-2 index with rejection sampling.
+        :type catalogue: TileCatalogue or None
+        """
         super().__init__(*args, **kwargs)
 
         if self.data_source is not DataSource.SENTINEL2_L1C:
             raise NotImplementedError
 
+        self.catalogue = catalogue
+        self._sampled_tile_ids = []
+
         self._archive_size = None
         self._archive_check_time = None  # In stateless service won't be needed anymore
 
     def get_random_tile(self):
+        if self.catalogue is not None:
+            return self.get_tile_info(self._get_catalogue_tile_id())
+
         random_tile_id = random.randint(1, self.get_archive_size())
         tile_info = self.get_tile_info(random_tile_id)
 
-        cover_percentage = float(tile_info['coverArea']) / 12055600804.0
+        cover_percentage = float(tile_info['coverArea']) / S2_TILE_AREA
 
-        if cover_percentage >= 0.1 and random.random() <= cover_percentage:
+        if cover_percentage >= MIN_TILE_COVERAGE and random.random() <= cover_percentage:
             return tile_info
 
         raise ValueError('Could not get a random tile with enough coverage from the archive')
 
+    def _get_catalogue_tile_id(self):
+        """ Provides a tile ID sampled from the catalogue. Tile IDs are sampled in batches and buffered.
+        """
+        try:
+            return int(self._sampled_tile_ids.pop())
+        except IndexError:
+            self._sampled_tile_ids = list(self.catalogue.sample_tile_ids(TILE_CATALOGUE_SAMPLE_SIZE))
+            return int(self._sampled_tile_ids.pop())
+
     def get_archive_size(self):
         """ This will collect archive size at most once per day
         """
         current_time = datetime.datetime.now()
         if self._archive_size is None or self._archive_check_time < current_time - datetime.timedelta(days=1):
             self._archive_check_time = current_time
-            self._archive_size = self.get_tile_id(self.get_tile_info('lastTile'), esa_id=False)
+            self._archive_size = self.get_tile_id(self.download_tile_info('lastTile'), esa_id=False)
         return self._archive_size
 
     @staticmethod
     def get_tile_info(tile_id):
+        """ Collects info about a tile from the cache or from S-2 index. Only fields from TILE_INFO_FIELDS are provided.
+        """
+        tile_info = TILE_INFO_CACHE.get(str(tile_id))
+
+        if tile_info is None:
+            tile_info = ShIndexSampling.download_tile_info(tile_id)
+            tile_info = {field: tile_info[field] for field in TILE_INFO_FIELDS if field in tile_info}
+            TILE_INFO_CACHE.set(str(tile_id), tile_info)
+
+        return tile_info
+
+    @staticmethod
+    def download_tile_info(tile_id):
+        """ Collects entire info about a tile from S-2 index
+        """
         LOGGER.info('Collecting data from S-2 index for tile %s', str(tile_id))
+        if os.path.isdir(BASE_INDEX_URL):
+            return read_data(os.path.join(BASE_INDEX_URL, '{}.json'.format(tile_id)))
         return get_json('{}{}'.format(BASE_INDEX_URL, tile_id))
 
     @staticmethod
@@ -189,7 +275,7 @@ class ShIndexSampling(SentinelHubSampling):
 
 class ShOgcSampling(SentinelHubSampling):
 
-    def __init__(self, area_of_interest, time_interval, maxcc, *args, **kwargs):
+    def __init__(self, area_of_interest, time_interval, maxcc, *args, cache_folder=None, **kwargs):
         """
         :param area_of_interest: Area of interest to sample from
         :type area_of_interest: sentinelhub.Geometry
@@ -197,37 +283,118 @@ class ShOgcSampling(SentinelHubSampling):
         :type time_interval:[datetime.datetime, datetime.datetime]
         :param maxcc: Maximal cloud coverage to allow to be sampled
         :type maxcc: float
+        :param cache_folder: A folder where AOI triangulation and AOI projected into UTM zones are persisted. If they
+            already exist there they are loaded instead of being computed.
+        :type cache_folder: str or None
         """
         super().__init__(*args, **kwargs)
 
         self.area_of_interest = area_of_interest
         self.time_interval = time_interval
         self.maxcc = maxcc
+        self.cache_folder = cache_folder
 
         self.time_interval_list = self._time_split(self.time_interval, resolution=datetime.timedelta(weeks=4))
-        self.aoi_triangulation = triangulate(self.area_of_interest.geometry)
+
+        self._projected_aoi_cache = LruCache(maxsize=PROJECTED_AOI_CACHE_SIZE)
+        self._sampling_region_cache = LruCache(maxsize=SAMPLING_REGION_CACHE_SIZE)
+
+        self.aoi_sampler = AreaSampler(self._load_triangles())
+        self._load_projected_aois()
+
+    def _load_triangles(self):
+        """ Loads triangulation of AOI from the cache folder or computes it and saves it there
+        """
+        path = None if self.cache_folder is None else os.path.join(self.cache_folder, 'triangles.npy')
+        if path is not None and os.path.isfile(path):
+            return np.load(path)
+
+        triangles = triangulate(self.area_of_interest.geometry)
+        if path is not None:
+            data = BytesIO()
+            np.save(data, triangles)
+            save_file(path, data.getvalue())
+
+        return triangles
+
+    def _load_projected_aois(self):
+        """ Loads AOI projected into each UTM zone which AOI spans from the cache folder or computes them and saves
+        them there. Projections into any other CRS are computed only when they are needed.
+        """
+        utm_crs_list = self._get_utm_crs_list()
+        if self.cache_folder is None or len(utm_crs_list) > MAX_PRECOMPUTED_UTM_ZONES:
+            return
+
+        for utm_crs in utm_crs_list:
+            path = os.path.join(self.cache_folder, 'aoi_{}.wkb'.format(int(utm_crs.value)))
+            if os.path.isfile(path):
+                with open(path, 'rb') as wkb_file:
+                    aoi_geometry = shapely.wkb.loads(wkb_file.read())
+                self._projected_aoi_cache.set(utm_crs, (aoi_geometry, shapely.prepared.prep(aoi_geometry)))
+            else:
+                aoi_geometry, _ = self._get_projected_aoi(utm_crs)
+                save_file(path, aoi_geometry.wkb)
+
+    def _get_utm_crs_list(self):
+        """ Provides a list of UTM CRS of all zones which intersect the bounding box of AOI
+        """
+        min_x, min_y, max_x, max_y = self.area_of_interest.transform(CRS.WGS84).geometry.bounds
+
+        zones = range(max(int((min_x + 180) // 6) + 1, 1), min(int((max_x + 180) // 6) + 1, 60) + 1)
+        epsg_prefixes = [prefix for prefix, is_included in [(326, max_y >= 0), (327, min_y < 0)] if is_included]
+
+        return [CRS('{}{:02d}'.format(prefix, zone)) for prefix in epsg_prefixes for zone in zones]
 
     def get_random_tile(self):
-        """Get a random tile over AOI and time interval"""
-        random_point = random_sample_point(self.area_of_interest.geometry, triangles=self.aoi_triangulation,
+        """ Get a random tile over AOI and time interval. Time intervals which are not cached yet are searched in
+        parallel and the first one with available tiles is used.
+        """
+        random_point = random_sample_point(self.area_of_interest.geometry, area_sampler=self.aoi_sampler,
                                            use_int_coords=False)
-        small_bbox = self._get_small_bbox(random_point)
+        grid_cell = self._get_grid_cell(random_point)
 
+        search_keys = []
         for time_interval in self._get_shuffled_time_intervals():
-            tiles = list(WebFeatureService(bbox=small_bbox, time_interval=time_interval,
-                                           data_source=self.data_source, maxcc=self.maxcc))
-            if tiles:
+            search_key = self.data_source, self.area_of_interest.crs, grid_cell, tuple(time_interval), self.maxcc
+            tiles = WFS_CACHE.get(search_key)
+            if tiles is None:
+                search_keys.append(search_key)
+            elif tiles:
                 return random.choice(tiles)
 
+        futures = [WFS_EXECUTOR.submit(self._search_tiles, search_key) for search_key in search_keys]
+        try:
+            for future in as_completed(futures):
+                tiles = future.result()
+                if tiles:
+                    return random.choice(tiles)
+        finally:
+            for future in futures:
+                future.cancel()
+
         raise ValueError('Could not sample a random point from given areas of interest, maybe no data is available')
 
-    def _get_small_bbox(self, point):
-        """ Create a small random bbox from a point for WFS search
-        TODO: sentinelhub-py should support WFS searches with a point object
+    def _get_grid_cell(self, point):
+        """ Provides indices of a spatial grid cell which contains the point. Nearby points share the same cell and
+        therefore the same WFS search results.
         """
-        x, y = point
-        eps = 0.0001 if self.area_of_interest.crs is CRS.WGS84 else 0.01
-        return BBox([x - eps, y - eps, x + eps, y + eps], crs=self.area_of_interest.crs)
+        cell_size = WFS_GRID_CELL_DEGREES if self.area_of_interest.crs is CRS.WGS84 else WFS_GRID_CELL_METERS
+        return tuple(int(math.floor(coord / cell_size)) for coord in point)
+
+    @staticmethod
+    def _search_tiles(search_key):
+        """ Searches for tiles intersecting a grid cell with WFS and caches the result, even if no tiles are found
+        """
+        data_source, crs, grid_cell, time_interval, maxcc = search_key
+
+        cell_size = WFS_GRID_CELL_DEGREES if crs is CRS.WGS84 else WFS_GRID_CELL_METERS
+        cell_bbox = BBox([grid_cell[0] * cell_size, grid_cell[1] * cell_size,
+                          (grid_cell[0] + 1) * cell_size, (grid_cell[1] + 1) * cell_size], crs=crs)
+
+        tiles = list(WebFeatureService(bbox=cell_bbox, time_interval=list(time_interval), data_source=data_source,
+                                       maxcc=maxcc))
+        WFS_CACHE.set(search_key, tiles)
+        return tiles
 
     @staticmethod
     def _time_split(time_interval, resolution=datetime.timedelta(weeks=4)):
@@ -249,14 +416,40 @@ class ShOgcSampling(SentinelHubSampling):
         return shuffled_time_intervals
 
     def get_sampling_geometry(self, tile_info):
-        tile_geometry = Geometry(tile_info['geometry'], crs=self.area_of_interest.crs)
+        """ Provides an intersection of tile footprint and AOI in UTM CRS of the tile. Intersections are cached per
+        tile ID.
+        """
+        tile_id = self.get_tile_id(tile_info)
+        sampling_geometry = self._sampling_region_cache.get(tile_id)
+
+        if sampling_geometry is None:
+            utm_crs = ShOgcSampling.get_crs(tile_info)
+            tile_geometry = Geometry(tile_info['geometry'], crs=self.area_of_interest.crs).transform(utm_crs).geometry
+            utm_aoi_geometry, prepared_aoi_geometry = self._get_projected_aoi(utm_crs)
+
+            # Warning: This intersection can be too small for sampling, that is why __next__ method is retrying the
+            # process
+            if prepared_aoi_geometry.contains(tile_geometry):
+                sampling_geometry = Geometry(tile_geometry, utm_crs)
+            else:
+                sampling_geometry = Geometry(tile_geometry.intersection(utm_aoi_geometry), utm_crs)
 
-        utm_crs = ShOgcSampling.get_crs(tile_info)
-        tile_geometry = tile_geometry.transform(utm_crs)
-        utm_aoi_geometry = self.area_of_interest.transform(utm_crs)
+            self._sampling_region_cache.set(tile_id, sampling_geometry)
+
+        return sampling_geometry
+
+    def _get_projected_aoi(self, crs):
+        """ Provides AOI geometry transformed into given CRS together with its prepared version. Both are cached per
+        CRS.
+        """
+        projected_aoi = self._projected_aoi_cache.get(crs)
 
-        # Warning: This intersection can be too small for sampling, that is why __next__ method is retrying the process
-        return Geometry(tile_geometry.geometry.intersection(utm_aoi_geometry.geometry), utm_crs)
+        if projected_aoi is None:
+            aoi_geometry = self.area_of_interest.transform(crs).geometry
+            projected_aoi = aoi_geometry, shapely.prepared.prep(aoi_geometry)
+            self._projected_aoi_cache.set(crs, projected_aoi)
+
+        return projected_aoi
 
     @staticmethod
     def get_crs(tile_info):
@@ -274,33 +467,122 @@ class ShOgcSampling(SentinelHubSampling):
 
 
 class GeopediaLayerSampling(Sampling):
+    """ Samples features of a Geopedia layer. Features are collected lazily in pages of GEOPEDIA_PAGE_SIZE features,
+    where each page is a single query for features with IDs larger than the last ID of the previous page.
 
+    Pages are discovered in the order of feature IDs during the first pass over the layer, with one page collected in
+    advance. Afterwards pages are visited in a random order and the next few pages are always being collected in
+    advance. Features of each page are shuffled.
+    """
     def __init__(self, source, feature_interval=None):
+        """
+        :param source: Source with a Geopedia layer
+        :type source: Source
+        :param feature_interval: Start and stop index of features which will be sampled. By default all features are
+            sampled.
+        :type feature_interval: (int, int) or None
+        """
         super().__init__()
 
         self.source = source
-
-        self.item_list = None
         self.feature_interval = feature_interval
 
+        self._pages = None
+        self._is_discovered = False
+        self._page_order = []
+        self._page_index = 0
+        self._page_futures = deque()
+        self._items = deque()
+        self._lock = threading.Lock()
+
     def __next__(self):
+        return self.make_task(self.get_next_item())
+
+    def get_next_item(self):
+        """ Provides the next feature in a random order. Once all features have been provided they are shuffled again.
 
-        if self.item_list is None:
-            self.set_item_list()
+        :raises: ValueError if all pages of features turn out to be empty, e.g. because features were removed from
+            the layer in the meantime
+        """
+        with self._lock:
+            if self._pages is None:
+                self._reset_pages()
 
-        self.index += 1
-        if self.index >= len(self.item_list):
-            self.index = 0
+            empty_pages = 0
+            while not self._items:
+                if self._is_discovered and empty_pages >= len(self._pages):
+                    self._reset_pages()
+                    raise ValueError('Failed to collect any features from Geopedia layer '
+                                     '{}'.format(self.source.geopedia_layer))
 
-        task = self.make_task(self.item_list[self.index])
-        return task
+                self._read_ahead()
 
-    def set_item_list(self):
-        LOGGER.info('Collecting data from Geopedia layer %d', int(self.source.geopedia_layer))
-        self.item_list = get_layer_item_list(int(self.source.geopedia_layer), interval=self.feature_interval)
+                page, future = self._page_futures.popleft()
+                self._add_page_items(page, future.result())
+                self._read_ahead()
+                empty_pages = 0 if self._items else empty_pages + 1
 
-        random.shuffle(self.item_list)
-        LOGGER.info('Collected data about %d features', len(self.item_list))
+            return self._items.popleft()
+
+    def _reset_pages(self):
+        """ Drops all known pages so that the layer is discovered again from the start
+        """
+        for _, future in self._page_futures:
+            future.cancel()
+        self._page_futures.clear()
+        self._pages = [(None, 0)]
+        self._is_discovered = False
+        self._page_order = []
+        self._page_index = 0
+
+    def _add_page_items(self, page, items):
+        """ Adds features of a collected page, which are in the feature interval, in a random order. If the page is the
+        last known page its last feature defines where the next page starts.
+
+        :param page: The last feature ID before the page and index of the first feature in the page
+        :type page: (int or None, int)
+        :param items: Features of the page
+        :type items: list(dict)
+        """
+        start, stop = self.feature_interval or (0, None)
+        _, offset = page
+
+        if not self._is_discovered and page == self._pages[-1]:
+            next_offset = offset + GEOPEDIA_PAGE_SIZE
+            if len(items) == GEOPEDIA_PAGE_SIZE and (stop is None or next_offset < stop):
+                self._pages.append((get_feature_id(items[-1]), next_offset))
+            else:
+                self._is_discovered = True
+                self._pages = [(after_id, page_offset) for after_id, page_offset in self._pages
+                               if page_offset + GEOPEDIA_PAGE_SIZE > start]
+                LOGGER.info('Discovered %d pages of Geopedia layer %s', len(self._pages), self.source.geopedia_layer)
+
+        items = items[max(start - offset, 0): None if stop is None else max(stop - offset, 0)]
+        random.shuffle(items)
+        self._items.extend(items)
+
+    def _read_ahead(self):
+        """ Makes sure that the next few pages are being collected. Until all pages are discovered only the next page
+        can be collected, because it starts after the last feature of the previous page.
+        """
+        while True:
+            if not self._is_discovered:
+                if self._page_futures:
+                    return
+                page = self._pages[-1]
+            else:
+                if len(self._page_futures) >= min(GEOPEDIA_READ_AHEAD_PAGES, len(self._pages)):
+                    return
+                if self._page_index == len(self._page_order):
+                    self._page_order = random.sample(self._pages, len(self._pages))
+                    self._page_index = 0
+                page = self._page_order[self._page_index]
+                self._page_index += 1
+
+            after_id, _ = page
+            self._page_futures.append((page, GEOPEDIA_EXECUTOR.submit(get_layer_item_list,
+                                                                      int(self.source.geopedia_layer),
+                                                                      after_id=after_id, limit=GEOPEDIA_PAGE_SIZE)))
 
     @staticmethod
     def get_bbox_coords(tile_coords, offset, window_shape, resolution=(10, 10)):
@@ -310,29 +592,34 @@ class GeopediaLayerSampling(Sampling):
 
 class GeopediaWaterBodySampling(GeopediaLayerSampling):
 
-    def __init__(self, source, window_shape, resolution):
+    def __init__(self, source, window_shape, resolution, engine=SamplingEngine.AUTO):
         super().__init__(source)
 
         self.window_shape = window_shape
         self.resolution = resolution
+        self.engine = SamplingEngine(engine)
+
+        self.palette = build_palette([self.source.layers[0]['classes'][0]['color']])
+        self.transparent_background = self.source.layers[0].get('transparent_background', False)
 
     def make_task(self, item):
         props = item['properties']
 
-        feature_id = int(item['@id'].rsplit('/', 1)[1])
+        feature_id = get_feature_id(item)
 
-        image, bbox = self._collect_data(props['Mask'][0]['objectPath'])
+        geotiff = self._collect_data(props['Mask'][0]['objectPath'])
+        bbox = self.get_bbox(geotiff)
         wb_geometry = shapely.geometry.shape(item['geometry'])
 
-        # sampled_image, sampled_bbox = self.random_sample_bbox(image, bbox, wb_geometry)
-        (sampled_image, sampled_bbox), wb_geometry = self.random_sample_geometry(image, bbox, wb_geometry)
+        # sampled_image, sampled_bbox = self.random_sample_bbox(geotiff, bbox, wb_geometry)
+        (sampled_image, sampled_bbox), wb_geometry = self.random_sample_geometry(geotiff, bbox, wb_geometry)
 
-        colored_sampled_image = np.zeros(sampled_image.shape[:2] + (3,), dtype=np.uint8)
-        colored_sampled_image[sampled_image == 1] = hex_to_rgb(self.source.layers[0]['classes'][0]['color'])
+        class_index = (sampled_image == 1).view(np.uint8)
 
         data_list = [{
             "layer": self.source.layers[0]['title'],
-            "image": encode_image(colored_sampled_image)
+            "image_id": LAYER_STORE.put(encode_indexed_png(class_index, self.palette,
+                                                           transparent_background=self.transparent_background))
         }]
 
         vector_data = [
@@ -349,62 +636,109 @@ class GeopediaWaterBodySampling(GeopediaLayerSampling):
         return dateutil.parser.parse(gpd_props['SAT_IMAGE_DATE'].split('T')[0]).date()
 
     def _collect_data(self, url):
+        """ Provides a decoded mask image from the cache. If it is not cached yet, it is downloaded and only the
+        sampled window of it will be decoded, while the entire image is decoded and cached in the background
+        """
+        cached_mask = MASK_CACHE.get(url)
+        if cached_mask is not None:
+            image, metadata = cached_mask
+            return GeoRaster(image, metadata['transform'], metadata['geo_ascii_params'])
+
         download_list = [DownloadRequest(url=url, save_response=False, data_type=MimeType.RAW)]
         raw_image = download_data(download_list)[0].result(timeout=60)
 
-        bbox = self.get_bbox(BytesIO(raw_image))
-
-        image = np.array(Image.open(BytesIO(raw_image)))
-
-        return image, bbox
+        geotiff = GeoTiff(raw_image)
+        MASK_CACHE_EXECUTOR.submit(self._cache_mask, url, geotiff)
+        return geotiff
 
     @staticmethod
-    def get_bbox(image_bytes):
-        with Image.open(image_bytes) as img:
-            meta_dict = {TAGS[key]: value for key, value in img.tag.items()}
-
-            if meta_dict['GeoAsciiParamsTag'] != ('WGS 84|',):
-                raise ValueError('Expected image in WGS84')
+    def _cache_mask(url, geotiff):
+        """ Decodes an entire mask image and caches it
+        """
+        try:
+            MASK_CACHE.set(url, geotiff.read(), {'transform': geotiff.transform,
+                                                 'geo_ascii_params': geotiff.geo_ascii_params})
+        except (ValueError, IOError) as exception:
+            LOGGER.warning('Failed to cache mask %s: %s', url, str(exception))
 
-        window_shape = meta_dict['ImageWidth'][0], meta_dict['ImageLength'][0]
+    @staticmethod
+    def get_bbox(geotiff):
+        if geotiff.geo_ascii_params != 'WGS 84|':
+            raise ValueError('Expected image in WGS84')
 
-        transform = (meta_dict['ModelTiepointTag'][3], meta_dict['ModelPixelScaleTag'][0], 0.0,
-                     meta_dict['ModelTiepointTag'][4], 0.0, -meta_dict['ModelPixelScaleTag'][1])
+        window_shape = geotiff.width, geotiff.height
+        transform = geotiff.transform
 
         bbox = BBox(GeopediaLayerSampling.get_bbox_coords((transform[0], transform[3]), (0, 0), window_shape,
                                                           (transform[1], -transform[5])), crs=CRS.WGS84)
         return bbox
 
-    def random_sample_geometry(self, image, bbox, wb_geometry_initial):
-        resolution = get_resolution(image, list(bbox))
+    def random_sample_geometry(self, geotiff, bbox, wb_geometry_initial):
+        """ Samples a window from the geometry and then decodes only the part of the image inside the window
+        """
+        resolution = geotiff.transform[1], -geotiff.transform[5]
         bbox_polygon = bbox.get_geometry()
         bbox_polygon = self._expand_geo_shape(bbox_polygon, (1 / resolution[0], 1 / resolution[1]))
 
         wb_geometry = self._expand_geo_shape(wb_geometry_initial, (1 / resolution[0], 1 / resolution[1]))
 
         wb_geometry = wb_geometry.buffer(max(self.window_shape))
-        wb_geometry = wb_geometry.simplify(2, preserve_topology=False)  # This simplifies geometry
+
+        # Raster engine doesn't need a simplified geometry
+        engine = select_sampling_engine(wb_geometry, self.engine)
+        if engine is SamplingEngine.VECTOR:
+            wb_geometry = wb_geometry.simplify(2, preserve_topology=False)  # This simplifies geometry
         wb_geometry = wb_geometry.intersection(bbox_polygon)
 
         LOGGER.debug('Reduced number of points in sampling vector shape from %d to %d',
                      count_points(wb_geometry_initial), count_points(wb_geometry))
 
-        sampled_rectangle = random_sample(wb_geometry, self.window_shape)
+        sampled_rectangle = random_sample(wb_geometry, self.window_shape, engine=engine)
         sampled_bbox = list(map(float, self._expand_geo_shape(sampled_rectangle, resolution).bounds))
 
         wb_geometry = self._expand_geo_shape(wb_geometry, resolution)
 
-        return sample_image_with_bbox(image, bbox, sampled_bbox), wb_geometry
+        image_shape = geotiff.height, geotiff.width
+        window_coords = get_window_coords(image_shape, bbox, sampled_bbox)
+        sampled_image = geotiff.read((geotiff.height - window_coords[3], geotiff.height - window_coords[1],
+                                      window_coords[0], window_coords[2]))
+
+        return (sampled_image, get_window_bbox(image_shape, bbox, window_coords)), wb_geometry
 
-    def random_sample_bbox(self, image, bbox, wb_geometry):
-        image, bbox = sample_image_with_bbox(image, bbox, list(wb_geometry.bounds), buffer=10)
+    def random_sample_bbox(self, geotiff, bbox, wb_geometry):
+        image, bbox = sample_image_with_bbox(geotiff.read(), bbox, list(wb_geometry.bounds), buffer=10)
 
         return random_sample_image(image, bbox, self.window_shape)
 
 
 class GeopediaOldAppResults(GeopediaLayerSampling):
     """ Special case of Geopedia sampling when we work with results of old version of classification results
+
+    Building a task requires downloading tile info and multiple masks. Therefore tasks of the next few features are
+    always being built in advance. At most PREFETCH_TASKS tasks are built at the same time and no more are started
+    until the oldest one is consumed.
     """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._task_futures = deque()
+        self._task_futures_lock = threading.Lock()
+
+        self.palettes = {
+            layer_prop['title']: build_palette([class_prop['color'] for class_prop in layer_prop['classes']])
+            for layer_prop in self.source.layers
+        }
+
+    def __next__(self):
+        with self._task_futures_lock:
+            while len(self._task_futures) < PREFETCH_TASKS:
+                self._task_futures.append(PREFETCH_EXECUTOR.submit(self._make_next_task))
+            future = self._task_futures.popleft()
+
+        return future.result()
+
+    def _make_next_task(self):
+        return self.make_task(self.get_next_item())
 
     def make_task(self, item):
         props = item['properties']
@@ -433,9 +767,17 @@ class GeopediaOldAppResults(GeopediaLayerSampling):
         return [x, y, x + resolution[0] * window_shape[0], y - resolution[1] * window_shape[1]]
 
     def _collect_data(self, mask_list):
-        download_list = [DownloadRequest(url=mask_props['objectPath'], save_response=False, data_type=MimeType.PNG)
-                         for mask_props in mask_list]
-        images = [future.result(timeout=60) for future in download_data(download_list)]
+        urls = [mask_props['objectPath'] for mask_props in mask_list]
+        cached_masks = {url: MASK_CACHE.get(url) for url in urls}
+
+        missing_urls = [url for url, cached_mask in cached_masks.items() if cached_mask is None]
+        download_list = [DownloadRequest(url=url, save_response=False, data_type=MimeType.PNG) for url in missing_urls]
+        for url, future in zip(missing_urls, download_data(download_list)):
+            image = future.result(timeout=60)
+            MASK_CACHE.set(url, image)
+            cached_masks[url] = image, {}
+
+        images = [cached_masks[url][0] for url in urls]
         image_names = [mask_props['niceName'] for mask_props in mask_list]
 
         # TODO: Change this hardcoded part
@@ -462,20 +804,21 @@ class GeopediaOldAppResults(GeopediaLayerSampling):
         for layer_prop in self.source.layers:
             layer_name = layer_prop['title']
             if layer_name in data_dict:
-                images = []
-                colors = []
-                for class_prop in layer_prop['classes']:
+                masks = []
+                class_indices = []
+                for class_index, class_prop in enumerate(layer_prop['classes'], start=1):
                     class_name = class_prop['title']
                     if class_name in data_dict[layer_name]:
-                        images.append(data_dict[layer_name][class_name])
-                        colors.append(class_prop['color'])
-
-                if images:
-                    merged_image = merge_images(images, colors)
+                        masks.append(data_dict[layer_name][class_name][..., 0] >= MASK_THRESHOLD)
+                        class_indices.append(class_index)
 
+                if masks:
+                    transparent_background = layer_prop.get('transparent_background', False)
+                    png_image = encode_indexed_png(get_class_index(masks, class_indices), self.palettes[layer_name],
+                                                   transparent_background=transparent_background)
                     data_list.append({
                         "layer": layer_name,
-                        "image": encode_image(merged_image)
+                        "image_id": LAYER_STORE.put(png_image)
                     })
 
         return data_list
@@ -2,64 +2,328 @@
 This module contains utility functions for sampling
 """
 
-import random
+import math
+import hashlib
+
+import numpy as np
+import mapbox_earcut
 import shapely.affinity
 import shapely.ops
+import shapely.vectorized
 
-from shapely.geometry import Polygon, MultiPolygon
+from shapely.geometry import Polygon, MultiPolygon, JOIN_STYLE
 
 from sentinelhub import BBox
 
-from eolearn.geometry import PointSampler
+from .cache import LruCache
+from .constants import SamplingEngine, FEASIBLE_REGION_CACHE_SIZE, FEASIBLE_REGION_CACHE_BYTES, \
+    RASTER_ENGINE_VERTEX_THRESHOLD, RASTER_ENGINE_MAX_PIXELS
+
+
+def _get_feasible_region_bytes(feasible_region):
+    """ Estimates memory footprint of a feasible region and its area sampler
+    """
+    geo_shape, area_sampler = feasible_region
+    return (len(geo_shape.wkb) if geo_shape else 0) + (0 if area_sampler is None else area_sampler.nbytes)
+
+
+FEASIBLE_REGION_CACHE = LruCache(maxsize=FEASIBLE_REGION_CACHE_SIZE, max_weight=FEASIBLE_REGION_CACHE_BYTES,
+                                 weigher=_get_feasible_region_bytes)
+RASTER_ORIGINS_CACHE = LruCache(maxsize=FEASIBLE_REGION_CACHE_SIZE, max_weight=FEASIBLE_REGION_CACHE_BYTES,
+                                weigher=lambda origins: origins[0].nbytes + origins[1].nbytes)
 
 
-def random_sample(geo_shape, window_shape):
+def random_sample(geo_shape, window_shape, engine=SamplingEngine.AUTO):
     """ Samples any geometrical shape with a rectangular window. The sampled window will have integer coordinates
     """
-    subgeo_shape = minkowski_difference(geo_shape, window_shape)
+    return random_sample_windows(geo_shape, window_shape, 1, engine=engine)[0]
+
+
+def random_sample_windows(geo_shape, window_shape, n_windows, engine=SamplingEngine.AUTO):
+    """ Samples any geometrical shape with multiple rectangular windows at once. The sampled windows will have integer
+    coordinates
+
+    :param engine: An engine which computes possible positions of windows
+    :type engine: SamplingEngine
+    :return: A list of at most `n_windows` sampled windows
+    :rtype: list(shapely.geometry.Polygon)
+    """
+    if select_sampling_engine(geo_shape, engine) is SamplingEngine.RASTER:
+        x_coords, y_coords = random_sample_raster_origins(geo_shape, window_shape, n_windows)
+    else:
+        subgeo_shape, area_sampler = get_feasible_region(geo_shape, window_shape)
+
+        if area_sampler is None:
+            raise ValueError('You cannot sample the area with so large window size')
+
+        x_coords, y_coords = random_sample_points(subgeo_shape, n_windows, area_sampler=area_sampler,
+                                                  use_int_coords=True)
+
+    return [Polygon([(x, y), (x + window_shape[0], y), (x + window_shape[0], y - window_shape[1]),
+                     (x, y - window_shape[1])]) for x, y in zip(x_coords, y_coords)]
+
+
+def select_sampling_engine(geo_shape, engine=SamplingEngine.AUTO):
+    """ Decides which sampling engine will be used. Automatically the raster engine is selected for geometries with
+    many vertices unless their raster would be too large.
+
+    :rtype: SamplingEngine
+    """
+    engine = SamplingEngine(engine)
+    if engine is not SamplingEngine.AUTO:
+        return engine
+
+    if not geo_shape or count_points(geo_shape) <= RASTER_ENGINE_VERTEX_THRESHOLD:
+        return SamplingEngine.VECTOR
+
+    raster_width, raster_height = _get_raster_shape(geo_shape)
+    if raster_width * raster_height > RASTER_ENGINE_MAX_PIXELS:
+        return SamplingEngine.VECTOR
+    return SamplingEngine.RASTER
+
+
+def random_sample_raster_origins(geo_shape, window_shape, n_origins):
+    """ Samples upper-left corners of rectangular windows uniformly at random from all integer positions where a
+    window fits into the rasterized shape
+
+    :return: Arrays of x and y coordinates of `n_origins` points
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    x_origins, y_origins = get_raster_window_origins(geo_shape, window_shape)
 
-    if not subgeo_shape:
+    if not x_origins.size:
         raise ValueError('You cannot sample the area with so large window size')
 
-    x, y = random_sample_point(subgeo_shape, use_int_coords=True)
+    indices = np.random.randint(x_origins.size, size=n_origins)
+    return x_origins[indices], y_origins[indices]
 
-    return Polygon([(x, y), (x + window_shape[0], y),
-                    (x + window_shape[0], y - window_shape[1]), (x, y - window_shape[1])])
 
+def get_raster_window_origins(geo_shape, window_shape):
+    """ Rasterizes the shape on a grid with pixels of size 1 and calculates all integer upper-left corners of windows
+    which contain only pixels inside the shape. A pixel is inside the shape if its center is inside. Window sums are
+    obtained from a summed-area table in a single vectorized pass. Because the computation is expensive and the same
+    shapes are sampled many times, results are cached.
 
-def random_sample_point(geo_shape, triangles=None, use_int_coords=False):
+    :return: Arrays of x and y coordinates of all possible upper-left corners
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    cache_key = hashlib.sha1(geo_shape.wkb).hexdigest(), tuple(window_shape)
+
+    origins = RASTER_ORIGINS_CACHE.get(cache_key)
+    if origins is not None:
+        return origins
+
+    width, height = window_shape
+    raster_width, raster_height = _get_raster_shape(geo_shape) if geo_shape else (0, 0)
+
+    origins = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    if raster_width >= width and raster_height >= height:
+        min_x, _, _, max_y = geo_shape.bounds
+        x_start, y_start = math.floor(min_x), math.ceil(max_y)
+
+        x_centers, y_centers = np.meshgrid(x_start + 0.5 + np.arange(raster_width),
+                                           y_start - 0.5 - np.arange(raster_height))
+        mask = shapely.vectorized.contains(geo_shape, x_centers, y_centers)
+
+        summed_area = np.zeros((raster_height + 1, raster_width + 1), dtype=np.int64)
+        summed_area[1:, 1:] = mask.cumsum(axis=0).cumsum(axis=1)
+
+        window_sums = summed_area[height:, width:] - summed_area[:-height, width:] - summed_area[height:, :-width] + \
+            summed_area[:-height, :-width]
+
+        rows, columns = np.nonzero(window_sums == width * height)
+        origins = x_start + columns, y_start - rows
+
+    RASTER_ORIGINS_CACHE.set(cache_key, origins)
+    return origins
+
+
+def _get_raster_shape(geo_shape):
+    """ Width and height of a raster with pixels of size 1 which covers the shape
+    """
+    min_x, min_y, max_x, max_y = geo_shape.bounds
+    return math.ceil(max_x) - math.floor(min_x), math.ceil(max_y) - math.floor(min_y)
+
+
+def get_feasible_region(geo_shape, window_shape):
+    """ Calculates a region of all possible upper-left corners of a rectangular window which fits into the shape,
+    together with a sampler of its area. Because the computation is expensive and the same shapes are sampled many
+    times, results are cached.
+
+    :return: Feasible region and its area sampler, which is `None` if the region has no surface
+    :rtype: (shapely.geometry.base.BaseGeometry, AreaSampler or None)
+    """
+    cache_key = hashlib.sha1(geo_shape.wkb).hexdigest(), tuple(window_shape)
+
+    feasible_region = FEASIBLE_REGION_CACHE.get(cache_key)
+    if feasible_region is None:
+        subgeo_shape = minkowski_difference(geo_shape, window_shape)
+        triangles = triangulate(subgeo_shape)
+
+        feasible_region = subgeo_shape, AreaSampler(triangles) if triangles.size else None
+        FEASIBLE_REGION_CACHE.set(cache_key, feasible_region)
+
+    return feasible_region
+
+
+class AreaSampler:
+    """ Samples points uniformly at random from a triangulated area
+
+    Triangles are selected with probabilities proportional to their areas by using Walker's alias method. Alias tables
+    are built once in O(n) time and afterwards k triangles are selected in O(k) vectorized time.
+    """
+    def __init__(self, triangles):
+        """
+        :param triangles: An array of triangle vertices of shape `(n, 3, 2)`, e.g. obtained with `triangulate`
+        :type triangles: numpy.ndarray
+        """
+        areas = get_triangle_areas(triangles)
+        if not areas.size or areas.sum() <= 0:
+            raise ValueError('Cannot sample an area without any surface')
+
+        self.triangles = triangles
+        self.area = areas.sum()
+        self.probabilities, self.aliases = self._build_alias_tables(areas / self.area)
+
+    @staticmethod
+    def _build_alias_tables(weights):
+        """ Builds alias tables with Vose's algorithm
+        """
+        n_weights = weights.size
+        scaled_weights = weights * n_weights
+        probabilities = np.ones(n_weights)
+        aliases = np.arange(n_weights)
+
+        small = [index for index in range(n_weights) if scaled_weights[index] < 1]
+        large = [index for index in range(n_weights) if scaled_weights[index] >= 1]
+
+        while small and large:
+            small_index, large_index = small.pop(), large.pop()
+
+            probabilities[small_index] = scaled_weights[small_index]
+            aliases[small_index] = large_index
+
+            scaled_weights[large_index] -= 1 - scaled_weights[small_index]
+            if scaled_weights[large_index] < 1:
+                small.append(large_index)
+            else:
+                large.append(large_index)
+
+        # Any remaining indices keep probability 1, they differ from it only because of numerical errors
+        return probabilities, aliases
+
+    @property
+    def nbytes(self):
+        """ Memory footprint of arrays of the sampler
+        """
+        return self.triangles.nbytes + self.probabilities.nbytes + self.aliases.nbytes
+
+    def sample_triangles(self, n_samples):
+        """ Selects triangles with probabilities proportional to their areas
+
+        :return: An array of triangle indices
+        :rtype: numpy.ndarray
+        """
+        indices = np.random.randint(self.probabilities.size, size=n_samples)
+        is_accepted = np.random.random(n_samples) < self.probabilities[indices]
+        return np.where(is_accepted, indices, self.aliases[indices])
+
+    def sample_points(self, n_samples):
+        """ Samples points uniformly at random by selecting triangles and sampling a point inside each of them with
+        barycentric coordinates
+
+        :return: An array of points of shape `(n_samples, 2)`
+        :rtype: numpy.ndarray
+        """
+        vertices = self.triangles[self.sample_triangles(n_samples)]
+
+        sqrt_r1 = np.sqrt(np.random.random(n_samples))[:, np.newaxis]
+        r2 = np.random.random(n_samples)[:, np.newaxis]
+
+        return (1 - sqrt_r1) * vertices[:, 0] + sqrt_r1 * (1 - r2) * vertices[:, 1] + sqrt_r1 * r2 * vertices[:, 2]
+
+
+def random_sample_point(geo_shape, area_sampler=None, use_int_coords=False):
     """
     :param geo_shape: Shapely geometry object
-    :param triangles: Pre-calculated list of triangles to avoid recalculating them every time
+    :param area_sampler: Pre-calculated sampler of the area to avoid recalculating triangles every time
     :param use_int_coords: Flag if return coordinates should be integer
     :return: x and y coordinates of a point sampled uniformly at random
     """
-    if triangles is None:
-        triangles = triangulate(geo_shape)
+    x_coords, y_coords = random_sample_points(geo_shape, 1, area_sampler=area_sampler, use_int_coords=use_int_coords)
+    return x_coords[0], y_coords[0]
 
-    # TODO: switch with random.choices(triangles, weights=[triangle.area for triangle in triangles], k=1)[0]
-    # doesn't work in Python 3.5
-    cumulative_areas = [0]
-    for idx, triangle in enumerate(triangles):
-        cumulative_areas.append(triangle.area + cumulative_areas[idx])
 
-    sample_tries = 10  # We are sampling integer points but there might not be any
-    while sample_tries:
-        triangle_index = _binary_search(cumulative_areas, random.random() * cumulative_areas[-1])
+def random_sample_points(geo_shape, n_points, area_sampler=None, use_int_coords=False):
+    """ Samples points uniformly at random from a geometrical shape in a single vectorized pass
 
-        point = PointSampler.random_point_triangle(triangles[triangle_index], use_int_coords=use_int_coords)
+    :param geo_shape: Shapely geometry object
+    :param n_points: Number of points to sample
+    :type n_points: int
+    :param area_sampler: Pre-calculated sampler of the area to avoid recalculating triangles every time
+    :type area_sampler: AreaSampler or None
+    :param use_int_coords: Flag if return coordinates should be integer
+    :return: Arrays of x and y coordinates of at most `n_points` points
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    if area_sampler is None:
+        area_sampler = AreaSampler(triangulate(geo_shape))
+
+    x_coords, y_coords = np.empty(0), np.empty(0)
+
+    sample_tries = 10  # We are sampling integer points but there might not be any
+    while sample_tries and x_coords.size < n_points:
+        candidates = area_sampler.sample_points(n_points - x_coords.size)
+        if use_int_coords:
+            candidates = np.round(candidates)
 
-        if geo_shape.intersects(point):
-            return point.coords.xy[0][0], point.coords.xy[1][0]
+        is_inside = _intersects_points(geo_shape, candidates)
 
+        x_coords = np.concatenate([x_coords, candidates[is_inside, 0]])
+        y_coords = np.concatenate([y_coords, candidates[is_inside, 1]])
         sample_tries -= 1
 
-    raise ValueError('Failed to sample the area{}'.format(' with a window that has integer coordinates'
-                                                          if use_int_coords else ''))
+    if not x_coords.size:
+        raise ValueError('Failed to sample the area{}'.format(' with a window that has integer coordinates'
+                                                              if use_int_coords else ''))
+
+    if use_int_coords:
+        return x_coords.astype(int), y_coords.astype(int)
+    return x_coords, y_coords
+
+
+def _intersects_points(geo_shape, points):
+    """ A vectorized check which points intersect with the geometrical shape, i.e. they are either in its interior or
+    on its boundary
+    """
+    is_inside = shapely.vectorized.contains(geo_shape, points[:, 0], points[:, 1])
+
+    on_boundary_candidates = ~is_inside
+    if on_boundary_candidates.any():
+        is_inside[on_boundary_candidates] = shapely.vectorized.touches(geo_shape, points[on_boundary_candidates, 0],
+                                                                       points[on_boundary_candidates, 1])
+    return is_inside
+
 
+def get_triangle_areas(triangles):
+    """ Calculates areas of triangles
 
-def minkowski_difference(geo_shape, window_shape):
+    :param triangles: An array of triangle vertices of shape `(n, 3, 2)`
+    :type triangles: numpy.ndarray
+    :return: An array of areas
+    :rtype: numpy.ndarray
+    """
+    edges1 = triangles[:, 1] - triangles[:, 0]
+    edges2 = triangles[:, 2] - triangles[:, 0]
+    return np.abs(edges1[:, 0] * edges2[:, 1] - edges1[:, 1] * edges2[:, 0]) / 2
+
+
+def minkowski_difference(geo_shape, window_shape, tolerance=None):
     """ Calculates Minkowski difference of any geometrical shape and a rectangular window
+
+    :param tolerance: If given, the complement of the shape is simplified with this tolerance before it is used in
+        Minkowski sum. The result can only get smaller, therefore all windows in it still fit into the shape.
+    :type tolerance: float or None
     """
     if not geo_shape:
         return geo_shape
@@ -67,7 +331,8 @@ def minkowski_difference(geo_shape, window_shape):
     area_hull = geo_shape.convex_hull
     area_diff = area_hull.difference(geo_shape)
     return convex_minkowski_difference(area_hull, window_shape).difference(minkowski_sum(area_diff, (-window_shape[0],
-                                                                                                     -window_shape[1])))
+                                                                                                     -window_shape[1]),
+                                                                                         tolerance=tolerance))
 
 
 def convex_minkowski_difference(geo_shape, window_shape):
@@ -83,21 +348,24 @@ def convex_minkowski_difference(geo_shape, window_shape):
     return geo_shape
 
 
-def minkowski_sum(geo_shape, window_shape):
+def minkowski_sum(geo_shape, window_shape, tolerance=None):
     """ Calculates Minkowski sum of any geometrical shape and a rectangular window
+
+    Minkowski sums of all triangles of the shape are merged together with a cascaded union, which is much faster than
+    merging them one by one.
+
+    :param tolerance: If given, the shape is simplified with this tolerance before the sum is calculated. Because the
+        shape is first buffered by the same tolerance, the simplified shape still contains the original one.
+    :type tolerance: float or None
     """
     if not geo_shape:
         return geo_shape
 
-    triangles = triangulate(geo_shape)
-    shape_union = None
-    for triangle in triangles:
-        triangle_sum = convex_minkowski_sum(triangle, window_shape)
-        if shape_union is None:
-            shape_union = triangle_sum
-        else:
-            shape_union = shape_union.union(triangle_sum)
-    return shape_union
+    if tolerance:
+        geo_shape = geo_shape.buffer(tolerance, join_style=JOIN_STYLE.mitre).simplify(tolerance)
+
+    triangle_sums = [convex_minkowski_sum(Polygon(triangle), window_shape) for triangle in triangulate(geo_shape)]
+    return shapely.ops.unary_union(triangle_sums)
 
 
 def convex_minkowski_sum(geo_shape, window_shape):
@@ -111,42 +379,39 @@ def convex_minkowski_sum(geo_shape, window_shape):
 def triangulate(geo_shape):
     """ Triangulation of geometry
 
-    Note that shapely.ops.triangulate actually triangulates convex hull of a polygon, that is why we need this
-    function. And this function uses the fact that shapely.ops.triangulate performs Delaunay triangulation
+    Each polygon, including its holes, is triangulated with ear clipping. Unlike Delaunay triangulation of
+    shapely.ops.triangulate, which triangulates convex hull of a polygon, this produces only triangles inside the
+    polygon in a single pass.
 
-    :param geo_shape: A polygon or multi-polygon
-    :type geo_shape: shapely.geometry.Polygon or shapely.geometry.MultiPolygon
-    :returns: A list of triangles
-    :rtype: list(shapely.geometry.Polygon)
+    :param geo_shape: A polygon, multi-polygon or a collection of geometries, from which only polygons are triangulated
+    :type geo_shape: shapely.geometry.base.BaseGeometry
+    :returns: An array of triangle vertices of shape `(n, 3, 2)`
+    :rtype: numpy.ndarray
     """
-    convex_poly_list = []
-    for triangle in shapely.ops.triangulate(geo_shape):
-        reduced_shape = triangle.intersection(geo_shape)
+    triangle_arrays = [np.empty((0, 3, 2))]
 
-        if isinstance(reduced_shape, MultiPolygon):
-            convex_poly_list.extend(list(reduced_shape))
-        else:
-            convex_poly_list.append(reduced_shape)
+    for polygon in _get_polygons(geo_shape):
+        rings = [polygon.exterior] + list(polygon.interiors)
+        vertices = np.concatenate([np.array(ring.coords, dtype=np.float64)[:-1, :2] for ring in rings])
+        ring_ends = np.cumsum([len(ring.coords) - 1 for ring in rings]).astype(np.uint32)
 
-    convex_poly_list = [poly for poly in convex_poly_list if poly.area > 0]
+        indices = mapbox_earcut.triangulate_float64(vertices, ring_ends)
+        triangle_arrays.append(vertices[indices.reshape(-1, 3)])
 
-    return [triangle for poly in convex_poly_list for triangle in shapely.ops.triangulate(poly)]
+    triangles = np.concatenate(triangle_arrays)
+    return triangles[get_triangle_areas(triangles) > 0]
 
 
-def _binary_search(increasing_list, value):
-    """ Helper function for binary search in a list of increasing values
+def _get_polygons(geo_shape):
+    """ Collects all non-empty polygons from any geometry
     """
-    left = 0
-    right = len(increasing_list) - 2
-
-    while left < right:
-        pivot = (left + right) // 2
-        if increasing_list[pivot + 1] >= value:
-            right = pivot
-        else:
-            left = pivot + 1
-
-    return left
+    if geo_shape.is_empty:
+        return []
+    if isinstance(geo_shape, Polygon):
+        return [geo_shape]
+    if hasattr(geo_shape, 'geoms'):
+        return [polygon for geometry in geo_shape.geoms for polygon in _get_polygons(geometry)]
+    return []
 
 
 def random_sample_image(image, bbox, window_shape):
@@ -165,53 +430,67 @@ def random_sample_image(image, bbox, window_shape):
 def sample_image_with_bbox(image, bbox, reduced_coords, buffer=0):
     """ Randomly sample geo-referenced image with a bounding box
     """
+    window_coords = get_window_coords(image.shape[:2], bbox, reduced_coords, buffer=buffer)
+
+    return sample_image_with_window(image, bbox, window_coords)
+
+
+def sample_image_with_window(image, bbox, window_coords):
+    """ Randomly sample geo-referenced image with a rectangular window
+    """
+    height = image.shape[0]
+
+    return image[height - window_coords[3]: height - window_coords[1], window_coords[0]: window_coords[2], ...], \
+        get_window_bbox(image.shape[:2], bbox, window_coords)
+
+
+def get_window_coords(image_shape, bbox, reduced_coords, buffer=0):
+    """ Get pixel coordinates of a window given by geo-referenced coordinates. Pixel rows are counted from the bottom
+    of the image.
+    """
     bbox_coords = list(bbox)
     reduced_coords = list(reduced_coords)
 
-    height, width = image.shape[:2]
-    resx, resy = get_resolution(image, bbox_coords)
+    height, width = image_shape
+    resx, resy = get_shape_resolution(image_shape, bbox_coords)
 
-    reduced_coords = [
+    return [
         max(round((reduced_coords[0] - bbox_coords[0]) / resx - buffer), 0),
         max(round((reduced_coords[1] - bbox_coords[1]) / resy - buffer), 0),
         min(round((reduced_coords[2] - bbox_coords[0]) / resx + buffer), width),
         min(round((reduced_coords[3] - bbox_coords[1]) / resy + buffer), height)
     ]
 
-    return sample_image_with_window(image, bbox, reduced_coords)
 
-
-def sample_image_with_window(image, bbox, window_coords):
-    """ Randomly sample geo-referenced image with a rectangular window
+def get_window_bbox(image_shape, bbox, window_coords):
+    """ Get a bounding box of a rectangular window of a geo-referenced image
     """
-    height = image.shape[0]
     bbox_coords = list(bbox)
-    resx, resy = get_resolution(image, bbox_coords)
+    resx, resy = get_shape_resolution(image_shape, bbox_coords)
 
-    return image[height - window_coords[3]: height - window_coords[1], window_coords[0]: window_coords[2], ...], \
-        BBox([bbox_coords[0] + resx * window_coords[0], bbox_coords[1] + resy * window_coords[1],
-              bbox_coords[0] + resx * window_coords[2], bbox_coords[1] + resy * window_coords[3]],
-             crs=bbox.get_crs())
+    return BBox([bbox_coords[0] + resx * window_coords[0], bbox_coords[1] + resy * window_coords[1],
+                 bbox_coords[0] + resx * window_coords[2], bbox_coords[1] + resy * window_coords[3]],
+                crs=bbox.get_crs())
 
 
 def get_resolution(image, bbox_coords):
     """ Get image resolution
     """
-    height, width = image.shape[:2]
-    return (bbox_coords[2] - bbox_coords[0]) / width, (bbox_coords[3] - bbox_coords[1]) / height
+    return get_shape_resolution(image.shape[:2], bbox_coords)
 
 
-def count_points(geo_shape):
-    """ Counts number of exterior points in geometrical shape
+def get_shape_resolution(image_shape, bbox_coords):
+    """ Get resolution of an image with given height and width
     """
-    point_cnt = 0
-    if isinstance(geo_shape, Polygon):
-        geo_shape = [geo_shape]
+    height, width = image_shape
+    return (bbox_coords[2] - bbox_coords[0]) / width, (bbox_coords[3] - bbox_coords[1]) / height
 
-    for poly_shape in geo_shape:
-        point_cnt += len(poly_shape.exterior.coords)
 
-    return point_cnt
+def count_points(geo_shape):
+    """ Counts number of exterior points of polygons in geometrical shape. Any other geometries, e.g. points or lines
+    in a geometry collection, have no area to be sampled and therefore they are not counted.
+    """
+    return sum(len(polygon.exterior.coords) for polygon in _get_polygons(geo_shape))
 
 
 def get_bbox_polygon(geo_shape):
@@ -2,9 +2,11 @@
 Module containing data schemas
 """
 from marshmallow import Schema, fields
+from marshmallow.validate import OneOf
 from marshmallow_jsonschema import JSONSchema
 from inflection import camelize
 
+from .constants import SamplingEngine
 from .utils import to_json
 
 REFERENCE_KEY = '$ref'
@@ -68,7 +70,12 @@ class SamplingSchema(Schema):
     window_width = fields.Int()
     window_height = fields.Int()
     buffer = fields.Int()
-    aoi = fields.Nested(AoiSchema, required=True)
+    engine = fields.Str(validate=OneOf([engine.value for engine in SamplingEngine]),
+                        description="Sampling engine, one of 'vector', 'raster' or 'auto'")
+    aoi = fields.Nested(AoiSchema, description='Area of interest, if not given the entire world is sampled')
+    time_interval = fields.List(fields.Str(), description='Start and end of time interval of sampled acquisitions',
+                                example=['2018-01-01', '2018-12-31'])
+    maxcc = fields.Float(description='Maximal cloud coverage of sampled acquisitions, between 0 and 1')
 
 
 class ClassSchema(Schema):
@@ -83,6 +90,7 @@ class LayerSchema(Schema):
     """
     title = fields.Str(required=True)
     paint_all = fields.Bool()
+    transparent_background = fields.Bool(description='If true pixels without a class are transparent in layer images')
     classes = fields.List(fields.Nested(ClassSchema), required=True)
 
 
@@ -169,7 +177,9 @@ class TaskDataSchema(Schema):
     """ Schema of raster data which will be passed to the app
     """
     layer = fields.Str()
-    image = fields.Str()
+    url = fields.Str(description='URL of an endpoint which serves the layer as a PNG image')
+    image = fields.Str(description='Base64 encoded PNG image, given in saved results and for tasks created before '
+                                   'layers got URLs')
 
 
 class TaskSchema(Schema):
@@ -4,6 +4,7 @@ This module implements the service for communicating with Classification App
 
 import os
 import sys
+import atexit
 import logging
 import datetime
 import traceback
@@ -24,6 +25,7 @@ from .utils import to_json, to_python
 from .schemas import get_flask_schema, AvailableInputSourcesSchema, CreateCampaignSchema, AvailableCampaignsSchema, \
     CampaignInfoSchema, TaskSchema
 from .exceptions import CustomServiceException
+from .constants import LAYER_MAX_AGE
 from ._version import __version__
 
 # pylint: disable=no-self-use
@@ -38,6 +40,7 @@ MESSAGE = 'message'
 GeopediaConfig.set_sh_config()
 # orchestrator = Orchestrator(LocalStore, filename='./../data/local_data.json')
 orchestrator = Orchestrator(GeopediaStore)
+atexit.register(orchestrator.shutdown)
 
 app = Flask(__name__)
 app.config["PROPAGATE_EXCEPTIONS"] = True
@@ -62,9 +65,11 @@ AUTHORIZATION_RESPONSES = {
 }
 CAMPAIGN_ID = 'campaign_id'
 TASK_ID = 'task_id'
+LAYER = 'layer'
 PARAMETER_DESCRIPTIONS = {
     CAMPAIGN_ID: 'A campaign ID string',
-    TASK_ID: 'A task ID string'
+    TASK_ID: 'A task ID string',
+    LAYER: 'A name of task layer'
 }
 
 jwt = JWTManager(app)
@@ -282,9 +287,41 @@ class TaskProvider(Resource):
         # TODO: Maybe user should be added only when he solves the first task?
         campaign = orchestrator.get_campaign(campaign_id, user_id, allow_new_user=True, add_new_user=True)
 
-        task = orchestrator.get_task(campaign)
+        task = orchestrator.get_task(campaign, user_id)
 
-        return to_json(task.get_app_json()), 200
+        def get_layer_url(layer):
+            return api.url_for(TaskLayerProvider, campaign_id=campaign.id, task_id=task.task_id, layer=layer)
+
+        return to_json(task.get_app_json(get_layer_url=get_layer_url)), 200
+
+
+# Layer names can contain slashes, which are decoded before routing, therefore a path converter is required
+@api.route('/campaigns/<string:{}>/tasks/<string:{}>/layers/<path:{}>'.format(CAMPAIGN_ID, TASK_ID, LAYER))
+@api.doc(
+    params=PARAMETER_DESCRIPTIONS,
+    responses={**GENERAL_RESPONSES, **AUTHORIZATION_RESPONSES}
+)
+class TaskLayerProvider(Resource):
+    """
+    To get an image of a task layer
+    curl "http://127.0.0.1:5000/campaigns/b410c84644d411e9b81c2202fd41f301/tasks/99/layers/Clouds" \
+    -H "Authorization: $(cat token.txt)" --output layer.png
+    """
+    @api.response(304, 'Image has not been modified')
+    @jwt_required
+    def get(self, campaign_id, task_id, layer):
+        """ Provide a PNG image of a task layer
+        """
+        user_id = get_jwt_identity()[1]
+        campaign = orchestrator.get_campaign(campaign_id, user_id)
+
+        image_id, image = orchestrator.get_task_layer(campaign, task_id, layer)
+
+        response = Response(image, mimetype='image/png')
+        # Images are content-addressed, therefore their IDs are strong ETags and they never change
+        response.set_etag(image_id)
+        response.headers['Cache-Control'] = 'private, max-age={}, immutable'.format(LAYER_MAX_AGE)
+        return response.make_conditional(request)
 
 
 @api.route('/campaigns/<string:{}>/tasks/<string:{}>/save'.format(CAMPAIGN_ID, TASK_ID))
@@ -7,9 +7,8 @@ import json
 import logging
 import datetime as dt
 from abc import ABC, abstractmethod
-import random
 
-from sentinelhub import read_data, get_json, GeopediaSession, GeopediaFeatureIterator, BBox, CRS
+from sentinelhub import read_data, GeopediaSession, BBox, CRS
 
 from .campaigns import Campaign
 from .users import User
@@ -18,6 +17,8 @@ from .sources import Source, SourceType
 from .users import Access, AccessType
 from .geopedia import SaveToGeopedia, GeopediaTable, GeopediaConfig
 from .tasks import Task
+from .cache import LruCache
+from .constants import QUERY_CACHE_SIZE, QUERY_CACHE_TTL, USER_ACCESS_CACHE_SIZE, USER_ACCESS_CACHE_TTL
 from .exceptions import MissingCampaignError
 
 
@@ -48,6 +49,18 @@ class Store(ABC):
     def add_task(self, campaign):
         raise NotImplementedError
 
+    @abstractmethod
+    def get_task(self, task_id, campaign_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_undone_tasks(self, campaign_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_task_done(self, task_id):
+        raise NotImplementedError
+
     @abstractmethod
     def save_task(self, task_id, user_id, campaign, request):
         raise NotImplementedError
@@ -121,6 +134,21 @@ class LocalStore(Store):
         # TODO: add task to local store
         raise RuntimeError("Method not currently implemented")
 
+    def get_task(self, task_id, campaign_id):
+        """ Retrieves a task of a campaign from local store """
+        # TODO: get task from local store
+        raise RuntimeError("Method not currently implemented")
+
+    def get_undone_tasks(self, campaign_id):
+        """ Retrieves tasks of a campaign without results from local store """
+        # TODO: get tasks from local store
+        raise RuntimeError("Method not currently implemented")
+
+    def is_task_done(self, task_id):
+        """ Checks in local store if results of a task have been saved """
+        # TODO: get task from local store
+        raise RuntimeError("Method not currently implemented")
+
     def delete_campaign(self, campaign_id):
         """ Delete campaign from available campaigns """
         # TODO: delete campaign from local store
@@ -152,6 +180,14 @@ class GeopediaStore(Store):
     TASK_TABLE = 'task_layer'
     TASK_USER_TABLE = 'task_user_layer'  # not used
 
+    # Results of queries to these tables are cached because they change rarely. Writes from this process invalidate
+    # the cache immediately, while writes from other processes become visible after the cache entry expires
+    CACHED_TABLES = {CAMPAIGN_TABLE, USER_TABLE, USER_CAMPAIGN_TABLE, INPUT_TABLE, OUTPUT_TABLE, SAMPLING_TABLE,
+                     UI_TABLE}
+
+    # Sampling parameters without a column in the sampling table are stored under this key in the JSON of UI table
+    UI_SAMPLING_KEY = 'sampling'
+
     def __init__(self):
         """ Reads local Geopedia configurations and collects info about tables from Geopedia. During the process an
         admin Geopedia session is created
@@ -159,7 +195,15 @@ class GeopediaStore(Store):
         self.geopedia_config, tables = GeopediaConfig.load_config()
         self._gpd_session = None
 
-        self.tables = {table_name: GeopediaTable.load(table_id, self) for table_name, table_id in tables.items()}
+        self.query_cache = LruCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+        self.tables = {
+            table_name: GeopediaTable.load(table_id, self,
+                                           query_cache=self.query_cache if table_name in self.CACHED_TABLES else None)
+            for table_name, table_id in tables.items()
+        }
+
+        # For each user a set of IDs of campaigns which the user can access
+        self._user_access_cache = LruCache(maxsize=USER_ACCESS_CACHE_SIZE, ttl=USER_ACCESS_CACHE_TTL)
 
     @property
     def gpd_session(self):
@@ -177,6 +221,11 @@ class GeopediaStore(Store):
                 raise RuntimeError('No session to Geopedia, exiting!')
         return self._gpd_session
 
+    def get_query_cache_stats(self):
+        """ Provides statistics about hits and misses of the cache of Geopedia table queries
+        """
+        return self.query_cache.get_stats()
+
     @staticmethod
     def _get_document_json(file_name, window_shape, is_image=True):
         document = {'objectType': 'IMAGE' if is_image else 'DOCUMENT',
@@ -197,7 +246,7 @@ class GeopediaStore(Store):
                               crs=CRS(task_data['crs'])),
                     acq_time=dt.datetime.strptime(task_data['datetime'], '%Y-%m-%d'),
                     window_shape=[window['height'], window['width']],
-                    data_list=json.loads(task_data['data']),
+                    data_list=Task.load_data_list(json.loads(task_data['data'])),
                     vector_data=task_data['vector_data'])
 
     def is_new_user(self, user_id):
@@ -259,11 +308,18 @@ class GeopediaStore(Store):
                                       campaign_link=campaign_data.id,
                                       counter=0))
 
+        campaign_ids = self._user_access_cache.get(int(user_id))
+        if campaign_ids is not None:
+            campaign_ids.add(campaign_id)
+
     def user_has_access(self, campaign_id, user_id):
         """ Check whether user has access to campaign
         """
-        campaigns = self.get_available_campaigns(user_id)
-        return any([campaign.id == campaign_id for campaign in campaigns])
+        campaign_ids = self._user_access_cache.get(int(user_id))
+        if campaign_ids is None:
+            campaign_ids = {campaign.id for campaign in self.get_available_campaigns(user_id)}
+
+        return campaign_id in campaign_ids
 
     def get_available_campaigns(self, user_id):
         """ Method to retrieve available campaigns (with basic info) for a given user
@@ -281,10 +337,13 @@ class GeopediaStore(Store):
         _, public_campaign_ids = self.get_public_campaigns()
         campaign_data = self.get_campaign_data(set(private_campaign_ids + public_campaign_ids))
 
-        return [Campaign(name=campaign['name'],
-                         id=campaign['campaign_id'],
-                         description=campaign['description'],
-                         access=campaign['access']) for campaign in campaign_data]
+        campaigns = [Campaign(name=campaign['name'],
+                              id=campaign['campaign_id'],
+                              description=campaign['description'],
+                              access=campaign['access']) for campaign in campaign_data]
+
+        self._user_access_cache.set(int(user_id), {campaign.id for campaign in campaigns})
+        return campaigns
 
     def get_campaign(self, campaign_id):
         """ Method to retrieve a campaign with full info from a given campaign ID
@@ -311,11 +370,13 @@ class GeopediaStore(Store):
         input_source = Source(**in_data.properties)
         output_source = Source(**out_data.properties)
 
-        sampling_data = self.tables[self.SAMPLING_TABLE].query_rows(campaign_data['sampling_link'])
+        sampling = dict(self.tables[self.SAMPLING_TABLE].query_rows(campaign_data['sampling_link']).properties)
 
         ui_data = self.tables[self.UI_TABLE].query_rows(campaign_data['ui_link'])
 
         ui_data['ui'] = ui_data['ui'].replace('\n', '\\n')  # Otherwise json couldn't decode new lines
+        ui = json.loads(ui_data['ui'])
+        sampling.update(ui.pop(self.UI_SAMPLING_KEY, None) or {})
 
         return Campaign(name=campaign_data['name'],
                         id=campaign_id,
@@ -323,8 +384,8 @@ class GeopediaStore(Store):
                         access=campaign_data['access'],
                         input_source=input_source,
                         output_source=output_source,
-                        sampling=sampling_data.properties,
-                        ui=json.loads(ui_data['ui']))
+                        sampling=sampling,
+                        ui=ui)
 
     def add_campaign(self, campaign, user_session_id):
         """ Add new campaign to Geopedia table
@@ -333,6 +394,12 @@ class GeopediaStore(Store):
         :param user_session_id: Session ID of user
         :return: Status of adding a campaign
         """
+        # Values without a column in the sampling table would be dropped, therefore they are stored with UI parameters
+        sampling_table = self.tables[self.SAMPLING_TABLE]
+        ui = dict(campaign.ui or {})
+        ui[self.UI_SAMPLING_KEY] = {name: value for name, value in campaign.sampling.items()
+                                    if value is not None and name not in sampling_table}
+
         gpd_saver = SaveToGeopedia(self.tables, self.gpd_session.session_id)
 
         # This data is collected first just in case user would not exist and an error would be raised here
@@ -343,7 +410,7 @@ class GeopediaStore(Store):
         post_data = gpd_saver.save_feature(self.SAMPLING_TABLE, campaign.sampling)
         sampling_link = post_data.id
 
-        post_data = gpd_saver.save_feature(self.UI_TABLE, {'ui': json.dumps(campaign.ui)})
+        post_data = gpd_saver.save_feature(self.UI_TABLE, {'ui': json.dumps(ui)})
         ui_link = post_data.id
 
         post_data = gpd_saver.save_feature(self.INPUT_TABLE, campaign.input_source.dump())
@@ -372,6 +439,11 @@ class GeopediaStore(Store):
                                     campaign_link=campaign_id,
                                     counter=0))
 
+        is_public = campaign.access.access_type is AccessType.PUBLIC
+        for user_id, campaign_ids in self._user_access_cache.items():
+            if is_public or user_id == campaign.access.owner_id:
+                campaign_ids.add(campaign.id)
+
     def delete_campaign(self, campaign_id):
         """ Delete campaign from available campaigns
 
@@ -393,17 +465,8 @@ class GeopediaStore(Store):
                                  campaign_data.properties,
                                  campaign_data.id)
 
-    def get_task(self, campaign):
-        """ Retrieve an available task from Geopedia table  """
-        # get available tasks
-        campaign_id = self.tables[self.CAMPAIGN_TABLE].query_columns('campaign_id', '="{}"'.format(campaign.id),
-                                                                     return_all=False).id
-        task_data_list = self.tables[self.TASK_TABLE].query_columns(['campaign_link', 'is_done'],
-                                                                    ['={}'.format(campaign_id), '=False'])
-        if not task_data_list:
-            return None, 0
-        task_data = random.choice(task_data_list)  # TODO: random?
-        return self._get_task(task_data), len(task_data_list)
+        for campaign_ids in self._user_access_cache.values():
+            campaign_ids.discard(campaign_id)
 
     def add_task(self, campaign):
         """ Write a new task to Geopedia table
@@ -423,13 +486,61 @@ class GeopediaStore(Store):
                                     crs=str(payload['crs']),
                                     window=json.dumps(payload['window']),
                                     datetime=payload['datetime'],
-                                    data=json.dumps(payload['data']),
+                                    data=json.dumps(task.get_stored_data_list()),
                                     vector_data=json.dumps(payload['vectorData'])
                                     if 'vectorData' in payload else None,
                                     campaign_link=campaign_link,
                                     is_done=False))
         return task
 
+    def get_task(self, task_id, campaign_id):
+        """ Retrieves a task of a campaign from Geopedia table
+
+        :param task_id: Task ID
+        :type task_id: str
+        :param campaign_id: Campaign ID
+        :type campaign_id: str
+        :return: A task or `None` if it doesn't exist or it belongs to another campaign
+        :rtype: Task or None
+        """
+        try:
+            campaign_link = self.tables[self.CAMPAIGN_TABLE].query_columns('campaign_id', '="{}"'.format(campaign_id),
+                                                                           return_all=False).id
+            task_data = self.tables[self.TASK_TABLE].query_columns(
+                ['task_id', 'campaign_link'], ['="{}"'.format(task_id), '={}'.format(campaign_link)], return_all=False)
+        except RuntimeError:
+            return None
+        return self._get_task(task_data)
+
+    def get_undone_tasks(self, campaign_id):
+        """ Retrieves all tasks of a campaign whose results haven't been saved yet
+
+        :param campaign_id: Campaign ID
+        :type campaign_id: str
+        :return: A list of tasks
+        :rtype: list(Task)
+        """
+        campaign_link = self.tables[self.CAMPAIGN_TABLE].query_columns('campaign_id', '="{}"'.format(campaign_id),
+                                                                       return_all=False).id
+        task_data_list = self.tables[self.TASK_TABLE].query_columns(['campaign_link', 'is_done'],
+                                                                    ['={}'.format(campaign_link), '=False'])
+        return [self._get_task(task_data) for task_data in task_data_list]
+
+    def is_task_done(self, task_id):
+        """ Checks if results of a task have already been saved, possibly by another process
+
+        :param task_id: Task ID
+        :type task_id: str
+        :return: `True` if task is done and `False` if it is not done or it doesn't exist
+        :rtype: bool
+        """
+        try:
+            task_data = self.tables[self.TASK_TABLE].query_columns('task_id', '="{}"'.format(task_id),
+                                                                   return_all=False)
+        except RuntimeError:
+            return False
+        return bool(task_data['is_done'])
+
     def save_task(self, task_id, user_id, campaign, response):
         """ Save result of task to geopedia
 
@@ -453,7 +564,7 @@ class GeopediaStore(Store):
         save_to_gpd.save_files(results_table,
                                dict(primaryGeometry=task_dict['primary_geometry'],
                                     task_id=task_id,
-                                    task_payload=json.dumps(task.get_app_json()),
+                                    task_payload=json.dumps(task.get_app_json(embed_images=True)),
                                     masks=masks),
                                files=files)
         # update task table
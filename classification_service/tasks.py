@@ -3,13 +3,17 @@ This module implements tasks
 """
 
 import time
-import datetime
+import queue
+import base64
 import logging
 import threading
+from collections import deque
+from concurrent.futures import Future
 
 from sentinelhub import CRS
 
-from .constants import MAX_TASKS
+from .cache import BlobStore
+from .constants import MAX_TASKS, TASK_WORKERS, TASK_LEASE_TIME, LAYER_STORE_DIR, LAYER_STORE_BYTES
 from .schemas import TaskSchema
 from .utils import get_uuid
 
@@ -18,6 +22,10 @@ UPPER_BOUND = 2 ** 50
 
 LOGGER = logging.getLogger(__name__)
 
+# Encoded images of task layers, data lists of tasks in memory only contain their IDs. Tasks in the store contain
+# images, which are put back into the layer store whenever a task is loaded
+LAYER_STORE = BlobStore(LAYER_STORE_DIR, max_bytes=LAYER_STORE_BYTES)
+
 
 class Task:
     """ Container with task parameters
@@ -39,7 +47,17 @@ class Task:
 
         self.props = props
 
-    def get_app_json(self):
+    def get_app_json(self, get_layer_url=None, embed_images=False):
+        """ Provides a task payload for the app. Layers which are in the layer store are given with URLs to the endpoint
+        serving them.
+
+        :param get_layer_url: A function which receives a layer name and returns a URL of its image
+        :type get_layer_url: function or None
+        :param embed_images: If `True` layer images are embedded as Base64 strings instead of given with URLs. Such
+            payload stays valid after images are evicted from the layer store, therefore it is used for saving results.
+        :type embed_images: bool
+        :raises: ValueError if images should be embedded but some of them are not in the layer store
+        """
         bbox_coords = list(self.bbox)
         crs = self.bbox.get_crs()
 
@@ -52,7 +70,7 @@ class Task:
             'window_width': self.window_shape[0],
             'window_height': self.window_shape[1],
             'datetime': self.acq_time,
-            'data': self.data_list
+            'data': [self._get_app_layer(layer_data, get_layer_url, embed_images) for layer_data in self.data_list]
         }
         if 'vector_data' in self.props and self.props['vector_data'] is not None:
             payload['vectorData'] = self.props['vector_data']
@@ -65,21 +83,300 @@ class Task:
         }
         return payload
 
+    def _get_app_layer(self, layer_data, get_layer_url, embed_images):
+        if 'image_id' not in layer_data:
+            return layer_data
+
+        if embed_images:
+            return self._embed_image(layer_data)
+
+        if get_layer_url is None:
+            return layer_data
+        return {
+            'layer': layer_data['layer'],
+            'url': get_layer_url(layer_data['layer'])
+        }
+
+    def _embed_image(self, layer_data):
+        """ Replaces an ID of a layer image with the image encoded as a Base64 string
+        """
+        image = LAYER_STORE.get(layer_data['image_id'])
+        if image is None:
+            raise ValueError('Image of layer {} of task {} is not in the layer store'.format(layer_data['layer'],
+                                                                                           self.task_id))
+        return {'layer': layer_data['layer'], 'image': base64.b64encode(image).decode('utf-8')}
+
+    def get_stored_data_list(self):
+        """ Provides a data list with embedded layer images, which is independent of the layer store
+
+        :return: A list of layers
+        :rtype: list(dict)
+        :raises: ValueError if some images are not in the layer store
+        """
+        return [self._embed_image(layer_data) if 'image_id' in layer_data else layer_data
+                for layer_data in self.data_list]
+
+    @staticmethod
+    def load_data_list(data_list):
+        """ Puts layer images of a stored data list into the layer store and replaces them with their IDs. This is the
+        inverse of `get_stored_data_list`.
+
+        :param data_list: A list of layers with embedded images
+        :type data_list: list(dict)
+        :return: A list of layers with image IDs
+        :rtype: list(dict)
+        """
+        return [{'layer': layer_data['layer'], 'image_id': LAYER_STORE.put(base64.b64decode(layer_data['image']))}
+                if 'image' in layer_data else layer_data for layer_data in data_list]
+
+    def get_layer_image_id(self, layer):
+        """ Provides an ID of layer image in the layer store
+
+        :return: Image ID or `None` if task doesn't have such layer in the layer store
+        :rtype: str or None
+        """
+        for layer_data in self.data_list:
+            if layer_data['layer'] == layer:
+                return layer_data.get('image_id')
+        return None
+
+
+class TaskQueue:
+    """ A thread-safe in-memory queue of prefetched tasks of a single campaign
+
+    A task taken from the queue is leased to a user. If the user doesn't save results before the lease expires the
+    task is returned to the queue.
+
+    Tasks created by this process are known not to be done. Tasks loaded from the store and tasks returned after an
+    expired lease could have been done by another process in the meantime, therefore they are marked as unverified.
+    """
+    def __init__(self, lease_time=TASK_LEASE_TIME):
+        """
+        :param lease_time: Number of seconds for which a task is leased to a user
+        :type lease_time: float
+        """
+        self.lease_time = lease_time
+
+        self._ready_tasks = deque()
+        self._leases = {}
+        self._unverified_task_ids = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """ Number of tasks which are ready to be leased
+        """
+        with self._lock:
+            self._reclaim_expired_leases()
+            return len(self._ready_tasks)
+
+    def put(self, task, is_verified=True):
+        """ Adds a new task to the queue
+
+        :param task: A task
+        :type task: Task
+        :param is_verified: Whether it is known that the task hasn't been done yet
+        :type is_verified: bool
+        """
+        with self._lock:
+            self._ready_tasks.append(task)
+            if not is_verified:
+                self._unverified_task_ids.add(task.task_id)
+
+    def is_verified(self, task_id):
+        """ Checks if it is known that the task hasn't been done by another process
+        """
+        with self._lock:
+            return task_id not in self._unverified_task_ids
+
+    def set_verified(self, task_id):
+        """ Marks that the task hasn't been done by another process
+        """
+        with self._lock:
+            self._unverified_task_ids.discard(task_id)
+
+    def lease(self, user_id):
+        """ Takes a task from the queue and leases it to a user
+
+        :param user_id: Geopedia user ID
+        :type user_id: int
+        :return: A leased task or `None` if the queue is empty
+        :rtype: Task or None
+        """
+        with self._lock:
+            self._reclaim_expired_leases()
+            if not self._ready_tasks:
+                return None
+
+            task = self._ready_tasks.popleft()
+            self._add_lease(task, user_id)
+            return task
+
+    def add_lease(self, task, user_id):
+        """ Leases a task which was not in the queue to a user
+        """
+        with self._lock:
+            self._add_lease(task, user_id)
+
+    def complete(self, task_id):
+        """ Removes a task whose results have been saved from the queue. If its lease has already expired the task
+        could have been returned among ready tasks, therefore it is removed from there as well.
+
+        :return: The completed task or `None` if the task was not in the queue
+        :rtype: Task or None
+        """
+        with self._lock:
+            self._unverified_task_ids.discard(task_id)
+            lease = self._leases.pop(task_id, None)
+            if lease is not None:
+                return lease[0]
 
-class TaskThreading(threading.Thread):
-    """ Class to handle creating tasks in the back-ground and adding them to Geopedia """
-    def __init__(self, campaign, store, *args, interval=1, **kwargs):
-        threading.Thread.__init__(self, target=self.run, *args, **kwargs)
-        # sleep time interval between geopedia requests
-        self.campaign = campaign
-        self.store = store
+            for task in self._ready_tasks:
+                if task.task_id == task_id:
+                    self._ready_tasks.remove(task)
+                    return task
+            return None
+
+    def _add_lease(self, task, user_id):
+        self._leases[task.task_id] = task, user_id, time.monotonic() + self.lease_time
+
+    def _reclaim_expired_leases(self):
+        current_time = time.monotonic()
+        expired_task_ids = [task_id for task_id, (_, _, expiration_time) in self._leases.items()
+                            if expiration_time < current_time]
+
+        for task_id in expired_task_ids:
+            task, user_id, _ = self._leases.pop(task_id)
+            LOGGER.debug("Lease of task %s by user %s expired", task_id, str(user_id))
+            self._ready_tasks.append(task)
+            self._unverified_task_ids.add(task_id)
+
+
+class TaskGenerationPool:
+    """ A fixed-size pool of background workers which create tasks, add them to the store and put them into task
+    queues
+
+    For each campaign at most one job is held at a time. If a refill of a campaign is requested while its previous job
+    is still waiting or running, the request joins that job instead of creating a new one.
+    """
+    def __init__(self, max_workers=TASK_WORKERS, interval=1):
+        """
+        :param max_workers: Number of worker threads
+        :type max_workers: int
+        :param interval: Sleep time in seconds between two consecutive requests to the store
+        :type interval: float
+        """
+        self.max_workers = max_workers
         self.interval = interval
 
-    def run(self):
+        self._job_queue = queue.Queue()
+        self._jobs = {}
+        self._workers = []
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+
+    @property
+    def queue_depth(self):
+        """ Number of jobs which are waiting for a free worker
+        """
+        return self._job_queue.qsize()
+
+    def submit(self, campaign, store, task_queue):
+        """ Requests creation of new tasks for a campaign until its task queue is filled up
+
+        :param campaign: A campaign for which tasks will be created
+        :type campaign: Campaign
+        :param store: A store where tasks will be added
+        :type store: Store
+        :param task_queue: A queue of prefetched tasks of the campaign
+        :type task_queue: TaskQueue
+        :return: A future of the job which will return the number of created tasks
+        :rtype: concurrent.futures.Future
+        """
+        with self._lock:
+            if self._stop_event.is_set():
+                raise RuntimeError('Task generation pool has already been shut down')
+
+            job = self._jobs.get(campaign.id)
+            if job is not None:
+                return job
+
+            self._start_workers()
+
+            job = Future()
+            self._jobs[campaign.id] = job
+            job.add_done_callback(lambda _: self._remove_job(campaign.id, job))
+
+            self._job_queue.put((job, campaign, store, task_queue))
+            return job
+
+    def shutdown(self, timeout=None):
+        """ Cancels all waiting jobs, stops running jobs after their current task and waits for workers to finish
+
+        :param timeout: Maximal number of seconds to wait for all workers together. Workers are daemon threads,
+            therefore the ones still blocked in a request to the store don't prevent the process from exiting.
+        :type timeout: float or None
+        """
+        with self._lock:
+            self._stop_event.set()
+
+            for job in list(self._jobs.values()):
+                job.cancel()
+
+            for _ in self._workers:
+                self._job_queue.put(None)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+
+    def _start_workers(self):
+        """ Workers are started only when they are needed. This way they are not started before a server forks worker
+        processes.
+        """
+        if self._workers:
+            return
+
+        for index in range(self.max_workers):
+            worker = threading.Thread(target=self._run_worker, name='TaskGenerationWorker-{}'.format(index),
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _remove_job(self, campaign_id, job):
+        with self._lock:
+            if self._jobs.get(campaign_id) is job:
+                del self._jobs[campaign_id]
+
+    def _run_worker(self):
+        while True:
+            job_params = self._job_queue.get()
+            if job_params is None:
+                return
+
+            job, campaign, store, task_queue = job_params
+            if not job.set_running_or_notify_cancel():
+                continue
+
+            try:
+                job.set_result(self._generate_tasks(campaign, store, task_queue))
+            except BaseException as exception:
+                # Nobody waits for results of background jobs, therefore failures have to be logged here
+                LOGGER.exception('Background generation of tasks for campaign %s failed', campaign.id)
+                job.set_exception(exception)
+
+    def _generate_tasks(self, campaign, store, task_queue):
+        task_count = 0
         for _ in range(MAX_TASKS):
+            if self._stop_event.is_set() or len(task_queue) >= MAX_TASKS:
+                break
+
             try:
-                current_task = self.store.add_task(self.campaign)
+                current_task = store.add_task(campaign)
+                task_queue.put(current_task)
+                task_count += 1
                 LOGGER.info("Task %s added to geopedia", current_task.task_id)
-                time.sleep(self.interval)
+                self._stop_event.wait(self.interval)
             except (RuntimeError, ValueError) as exception:
                 LOGGER.debug("Error creating tasks in the background: %s", str(exception))
+
+        return task_count
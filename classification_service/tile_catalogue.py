@@ -0,0 +1,184 @@
+"""
+This module implements a catalogue of Sentinel-2 tiles, which allows sampling tiles without any requests to S-2 index
+
+The catalogue is built offline with a command
+
+> build-tile-catalogue --path <folder>
+"""
+
+import os
+import shutil
+import logging
+import argparse
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sentinelhub import DownloadFailedException
+
+from .sampling import ShIndexSampling
+from .constants import TILE_CATALOGUE_PATH, TILE_CATALOGUE_CHUNK_SIZE, S2_TILE_AREA, MIN_TILE_COVERAGE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TileCatalogue:
+    """ A columnar catalogue of tiles with enough coverage. Each column is stored in its own `.npy` file and loaded as a
+    memory-mapped array.
+
+    Tiles are sampled with probabilities proportional to their coverage, which is the same distribution as the one
+    obtained by rejection sampling of tiles from S-2 index. Other tile properties, including the cover geometry which
+    is required for sampling, are still obtained from S-2 index, therefore the catalogue doesn't store them.
+    """
+    COLUMNS = {
+        'tile_id': np.int64,
+        'coverage': np.float32,
+        'cumulative_coverage': np.float64
+    }
+
+    def __init__(self, path):
+        """
+        :param path: A folder with catalogue columns
+        :type path: str
+        """
+        self.path = path
+        self.columns = {name: np.load(os.path.join(path, '{}.npy'.format(name)), mmap_mode='r')
+                        for name in self.COLUMNS}
+
+        if not self:
+            raise ValueError('Tile catalogue in {} is empty'.format(path))
+
+    def __len__(self):
+        return self.columns['tile_id'].size
+
+    @staticmethod
+    def load(path=TILE_CATALOGUE_PATH):
+        """ Loads a catalogue if it exists
+
+        :return: A catalogue or `None` if it doesn't exist
+        :rtype: TileCatalogue or None
+        """
+        if not os.path.isfile(os.path.join(path, 'tile_id.npy')):
+            return None
+        return TileCatalogue(path)
+
+    def sample_tile_ids(self, n_samples):
+        """ Samples S-2 index tile IDs with probabilities proportional to tile coverage in a single vectorized draw
+
+        :return: An array of tile IDs
+        :rtype: numpy.ndarray
+        """
+        cumulative_coverage = self.columns['cumulative_coverage']
+        values = np.random.random(n_samples) * cumulative_coverage[-1]
+        indices = np.minimum(np.searchsorted(cumulative_coverage, values, side='right'), len(self) - 1)
+
+        return self.columns['tile_id'][indices]
+
+    @staticmethod
+    def save(path, tile_ids, coverages):
+        """ Saves tiles into a new catalogue. Any existing catalogue in the same folder is replaced once the new one is
+        written.
+
+        :param path: A folder where catalogue will be saved
+        :type path: str
+        :param tile_ids: IDs of tiles in S-2 index
+        :type tile_ids: numpy.ndarray
+        :param coverages: Coverages of tiles, i.e. fractions of tile areas covered with data
+        :type coverages: numpy.ndarray
+        """
+        order = np.argsort(tile_ids, kind='mergesort')
+        columns = {
+            'tile_id': tile_ids[order],
+            'coverage': coverages[order],
+            'cumulative_coverage': np.cumsum(coverages[order], dtype=np.float64)
+        }
+
+        temp_path = '{}.tmp'.format(path.rstrip(os.sep))
+        os.makedirs(temp_path, exist_ok=True)
+        for name, dtype in TileCatalogue.COLUMNS.items():
+            np.save(os.path.join(temp_path, '{}.npy'.format(name)), np.asarray(columns[name], dtype=dtype))
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(temp_path, path)
+
+        LOGGER.info('Saved catalogue of %d tiles to %s', tile_ids.size, path)
+
+
+def get_tile_coverage(tile_id):
+    """ Downloads info about a tile from S-2 index and keeps only its coverage so that large tile payloads are
+    released right away
+
+    :param tile_id: ID of a tile in S-2 index
+    :type tile_id: int
+    :return: Tile coverage or `None` if the tile doesn't exist
+    :rtype: float or None
+    """
+    try:
+        tile_info = ShIndexSampling.download_tile_info(tile_id)
+    except (DownloadFailedException, IOError) as exception:
+        LOGGER.debug('Skipping tile %d: %s', tile_id, str(exception))
+        return None
+    return float(tile_info['coverArea']) / S2_TILE_AREA
+
+
+def collect_tile_coverages(tile_ids, workers=8, chunk_size=TILE_CATALOGUE_CHUNK_SIZE):
+    """ Collects coverages of tiles from S-2 index in parallel. Tiles are requested in chunks so that the number of
+    pending requests stays bounded, and only tiles with enough coverage are kept in compact arrays.
+
+    :param tile_ids: IDs of tiles in S-2 index
+    :type tile_ids: iterable(int)
+    :param workers: Number of parallel requests
+    :type workers: int
+    :param chunk_size: Number of tiles requested at once
+    :type chunk_size: int
+    :return: Arrays of IDs and coverages of tiles with enough coverage
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    tile_id_chunks, coverage_chunks = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.float32)]
+    tile_ids = iter(tile_ids)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            chunk = np.fromiter(islice(tile_ids, chunk_size), dtype=np.int64)
+            if not chunk.size:
+                break
+
+            coverages = np.array([np.nan if coverage is None else coverage
+                                  for coverage in executor.map(get_tile_coverage, chunk.tolist())], dtype=np.float32)
+            has_coverage = coverages >= MIN_TILE_COVERAGE
+
+            tile_id_chunks.append(chunk[has_coverage])
+            coverage_chunks.append(coverages[has_coverage])
+            LOGGER.info('Collected tiles up to %d, %d with enough coverage', chunk[-1], np.count_nonzero(has_coverage))
+
+    return np.concatenate(tile_id_chunks), np.concatenate(coverage_chunks)
+
+
+def main():
+    """ Command line entry point for building a tile catalogue
+    """
+    parser = argparse.ArgumentParser(description='Builds a catalogue of Sentinel-2 tiles from S-2 index')
+    parser.add_argument('--path', default=TILE_CATALOGUE_PATH, help='Folder where catalogue will be saved')
+    parser.add_argument('--start', type=int, default=1, help='First tile ID in S-2 index')
+    parser.add_argument('--end', type=int, default=None,
+                        help='Last tile ID in S-2 index, by default the last tile in the archive')
+    parser.add_argument('--workers', type=int, default=8, help='Number of parallel requests to S-2 index')
+    parser.add_argument('--chunk-size', type=int, default=TILE_CATALOGUE_CHUNK_SIZE,
+                        help='Number of tiles requested from S-2 index at once')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    end = args.end
+    if end is None:
+        end = ShIndexSampling.get_tile_id(ShIndexSampling.download_tile_info('lastTile'), esa_id=False)
+
+    tile_ids, coverages = collect_tile_coverages(range(args.start, end + 1), workers=args.workers,
+                                                 chunk_size=args.chunk_size)
+    TileCatalogue.save(args.path, tile_ids, coverages)
+
+
+if __name__ == '__main__':
+    main()
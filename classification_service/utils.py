@@ -4,22 +4,77 @@ This utility module handles transforming data from json to python and back
 
 import json
 import uuid
+from enum import Enum
+from functools import lru_cache
 
+import numpy as np
 from inflection import camelize, underscore
 
+KEY_CACHE_SIZE = 4096
+JSON_LEAF_TYPES = frozenset([str, int, float, bool, type(None)])
+
 
 def to_python(data):
     """ Transforms key values into underscore case
     """
-    return json.loads(json.dumps(data), object_hook=lambda subdict: {underscore(key):
-                                                                     value for key, value in subdict.items()})
+    return _convert_keys(data, _underscore_key)
 
 
 def to_json(data):
     """ Transforms key values in camel case
     """
-    return json.loads(json.dumps(data), object_hook=lambda subdict: {camelize(key, uppercase_first_letter=False):
-                                                                     value for key, value in subdict.items()})
+    return _convert_keys(data, _camelize_key)
+
+
+def _convert_keys(data, convert_key):
+    """ Recursively converts keys of all dictionaries in a JSON-like structure. Only containers are copied, other
+    values are reused. The result is the same as if the structure would be serialized to JSON and parsed back.
+
+    Additionally, enums are converted into their values and numpy scalars into Python scalars, which `json` module
+    can't serialize.
+    """
+    if type(data) in JSON_LEAF_TYPES:
+        return data
+
+    if isinstance(data, dict):
+        return {convert_key(key if isinstance(key, str) else json.dumps(key)):
+                value if type(value) in JSON_LEAF_TYPES else _convert_keys(value, convert_key)
+                for key, value in data.items()}
+
+    if isinstance(data, (list, tuple)):
+        return [value if type(value) in JSON_LEAF_TYPES else _convert_keys(value, convert_key) for value in data]
+
+    return _convert_keys(_get_json_value(data), convert_key)
+
+
+def _get_json_value(data):
+    """ Converts a value, which is not an instance of a JSON type, into a value which `json` module can serialize
+    """
+    if isinstance(data, Enum):
+        return data.value
+
+    if isinstance(data, np.generic):
+        return data.item()
+
+    # Subclasses of JSON types are serialized by `json` module as instances of their base types
+    if isinstance(data, str):
+        return str.__str__(data)
+    if isinstance(data, int):
+        return int(data)
+    if isinstance(data, float):
+        return float(data)
+
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(data).__name__))
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _underscore_key(key):
+    return underscore(key)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _camelize_key(key):
+    return camelize(key, uppercase_first_letter=False)
 
 
 def get_uuid():
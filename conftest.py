@@ -0,0 +1,3 @@
+"""
+Makes the `classification_service` and `benchmarks` packages importable in tests without installing them
+"""
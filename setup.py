@@ -24,9 +24,10 @@ setup(name='classification-service',
       url='https://github.com/sentinel-hub/classification-app-backend.git',
       author='Sinergise EO research team',
       author_email='eoresearch@sinergise.com',
-      packages=find_packages(),
+      packages=find_packages(exclude=['tests', 'benchmarks']),
       package_data={'data': ['data/input_sources.json']},
       include_package_data=True,
       install_requires=parse_requirements("requirements.txt"),
       extras_require={'DEV': parse_requirements("requirements-dev.txt")},
+      entry_points={'console_scripts': ['build-tile-catalogue=classification_service.tile_catalogue:main']},
       zip_safe=False)
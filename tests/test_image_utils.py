@@ -0,0 +1,189 @@
+"""
+Tests of image utilities
+"""
+
+import io
+import zlib
+import struct
+
+import pytest
+import numpy as np
+from PIL import Image
+
+from classification_service.image_utils import merge_images, merge_images_with_palette, get_class_index, \
+    build_palette, hex_to_rgb, encode_indexed_png, unpack_bits, GeoTiff, MASK_THRESHOLD
+from benchmarks.reference import assign_colors
+
+
+def get_random_masks(n_classes, shape=(64, 48), seed=0):
+    random_state = np.random.RandomState(seed)
+    images = [random_state.randint(0, 256, size=shape + (4,)).astype(np.uint8) for _ in range(n_classes)]
+    colors = ['#{:02x}{:02x}{:02x}'.format(*random_state.randint(0, 256, size=3)) for _ in range(n_classes)]
+    return images, colors
+
+
+@pytest.mark.parametrize('n_classes', [1, 2, 7, 255])
+def test_merge_images_matches_previous_compositing(n_classes):
+    images, colors = get_random_masks(n_classes)
+
+    merged_image = merge_images(images, colors)
+
+    assert merged_image.dtype == np.uint8
+    assert np.array_equal(merged_image, assign_colors(images, colors))
+
+
+def test_merge_images_with_class_indices():
+    images, colors = get_random_masks(3)
+    class_indices = [2, 5, 1]
+    palette = build_palette(['#000000'] * 5)
+    for class_index, color in zip(class_indices, colors):
+        palette[class_index] = hex_to_rgb(color)
+
+    merged_image = merge_images_with_palette(images, palette, class_indices=class_indices)
+
+    assert np.array_equal(merged_image, assign_colors(images, colors))
+
+
+def test_get_class_index_prefers_last_mask():
+    masks = [np.array([[True, True], [False, False]]), np.array([[False, True], [True, False]])]
+
+    assert np.array_equal(get_class_index(masks), [[1, 2], [2, 0]])
+    assert np.array_equal(get_class_index(masks, class_indices=[7, 3]), [[7, 3], [3, 0]])
+
+    with pytest.raises(ValueError):
+        get_class_index([masks[0]] * 256)
+
+
+def test_encode_indexed_png_round_trip():
+    images, colors = get_random_masks(5)
+    palette = build_palette(colors)
+    class_index = get_class_index([image[..., 0] >= MASK_THRESHOLD for image in images])
+
+    png_image = Image.open(io.BytesIO(encode_indexed_png(class_index, palette)))
+
+    assert png_image.mode == 'P'
+    assert np.array_equal(np.array(png_image.convert('RGB')), merge_images(images, colors))
+
+
+def test_encode_indexed_png_with_transparent_background():
+    class_index = np.array([[0, 1], [2, 0]], dtype=np.uint8)
+    palette = build_palette(['#ff0000', '#00ff00'])
+
+    png_image = Image.open(io.BytesIO(encode_indexed_png(class_index, palette, transparent_background=True)))
+
+    assert np.array_equal(np.array(png_image.convert('RGBA'))[..., 3], [[0, 255], [255, 0]])
+
+
+def save_pil_tiff(image, **params):
+    data = io.BytesIO()
+    Image.fromarray(image).save(data, 'TIFF', **params)
+    return data.getvalue()
+
+
+def save_tiled_tiff(image, tile_shape, compression=1, predictor=1):
+    """ Writes a tiled TIFF with geo-referencing tags, because PIL can only write striped images
+    """
+    image = image[..., np.newaxis] if image.ndim == 2 else image
+    height, width, samples = image.shape
+    tile_height, tile_width = tile_shape
+
+    chunks = []
+    for row in range(0, height, tile_height):
+        for col in range(0, width, tile_width):
+            tile = np.zeros((tile_height, tile_width, samples), dtype=image.dtype)
+            part = image[row: row + tile_height, col: col + tile_width]
+            tile[:part.shape[0], :part.shape[1]] = part
+            if predictor == 2:
+                tile[:, 1:] -= tile[:, :-1].copy()
+            chunk = tile.astype(image.dtype.newbyteorder('<')).tobytes()
+            chunks.append(zlib.compress(chunk) if compression == 8 else chunk)
+
+    data = bytearray(b'II*\x00\x00\x00\x00\x00')
+    offsets = []
+    for chunk in chunks:
+        offsets.append(len(data))
+        data.extend(chunk)
+
+    sample_format = {'u': 1, 'i': 2, 'f': 3}[image.dtype.kind]
+    tags = [
+        (256, 'I', [width]), (257, 'I', [height]), (258, 'H', [8 * image.dtype.itemsize] * samples),
+        (259, 'H', [compression]), (262, 'H', [2 if samples == 3 else 1]), (277, 'H', [samples]),
+        (284, 'H', [1]), (317, 'H', [predictor]), (322, 'H', [tile_width]), (323, 'H', [tile_height]),
+        (324, 'I', offsets), (325, 'I', [len(chunk) for chunk in chunks]), (339, 'H', [sample_format] * samples),
+        (33550, 'd', [10.0, 20.0, 0.0]), (33922, 'd', [0.0, 0.0, 0.0, 500000.0, 5000000.0, 0.0])
+    ]
+    type_ids = {'H': 3, 'I': 4, 'd': 12}
+
+    entries = []
+    for tag_id, value_format, values in tags:
+        value = struct.pack('<{}{}'.format(len(values), value_format), *values)
+        if len(value) > 4:
+            offset = len(data)
+            data.extend(value)
+            value = struct.pack('<I', offset)
+        entries.append(struct.pack('<HHI', tag_id, type_ids[value_format], len(values)) + value.ljust(4, b'\x00'))
+
+    data[4:8] = struct.pack('<I', len(data))
+    data.extend(struct.pack('<H', len(entries)) + b''.join(entries) + struct.pack('<I', 0))
+    return bytes(data)
+
+
+def get_random_image(shape, dtype=np.uint8, seed=0):
+    random_state = np.random.RandomState(seed)
+    return random_state.randint(0, np.iinfo(dtype).max, size=shape).astype(dtype)
+
+
+WINDOWS = [None, (0, 1, 0, 1), (5, 30, 3, 20), (16, 32, 16, 32), (40, 100, -5, 50), (30, 30, 0, 10)]
+
+
+def assert_windows_match_pil(tiff_data):
+    geotiff = GeoTiff(tiff_data)
+    full_image = np.array(Image.open(io.BytesIO(tiff_data)))
+
+    for window in WINDOWS:
+        row_start, row_stop, col_start, col_stop = window or (0, geotiff.height, 0, geotiff.width)
+        expected = full_image[max(row_start, 0): row_stop, max(col_start, 0): col_stop]
+        assert np.array_equal(geotiff.read(window), expected), window
+
+
+@pytest.mark.parametrize('shape', [(45, 37), (45, 37, 3)])
+@pytest.mark.parametrize('params', [
+    {},
+    {'tiffinfo': {278: 7}},
+    {'compression': 'tiff_deflate', 'tiffinfo': {278: 7}},
+    {'compression': 'tiff_adobe_deflate', 'tiffinfo': {317: 2}},
+    {'compression': 'tiff_deflate', 'tiffinfo': {278: 7, 317: 2}},
+    {'compression': 'packbits', 'tiffinfo': {278: 7}}
+])
+def test_geotiff_reads_striped_images(shape, params):
+    tiff_data = save_pil_tiff(get_random_image(shape), **params)
+
+    assert GeoTiff(tiff_data).is_supported
+    assert_windows_match_pil(tiff_data)
+
+
+@pytest.mark.parametrize('shape, dtype', [((45, 37), np.uint8), ((45, 37), np.uint16), ((45, 37, 3), np.uint8)])
+@pytest.mark.parametrize('compression, predictor', [(1, 1), (8, 1), (8, 2)])
+def test_geotiff_reads_tiled_images(shape, dtype, compression, predictor):
+    tiff_data = save_tiled_tiff(get_random_image(shape, dtype=dtype), (16, 16), compression=compression,
+                                predictor=predictor)
+    geotiff = GeoTiff(tiff_data)
+
+    assert geotiff.is_supported
+    assert geotiff.transform == (500000.0, 10.0, 0.0, 5000000.0, 0.0, -20.0)
+    assert_windows_match_pil(tiff_data)
+
+
+def test_geotiff_falls_back_to_pil_for_unsupported_layout():
+    tiff_data = save_pil_tiff(get_random_image((45, 37)), compression='tiff_lzw')
+
+    assert not GeoTiff(tiff_data).is_supported
+    assert_windows_match_pil(tiff_data)
+
+
+def test_unpack_bits():
+    packed = bytes.fromhex('FE AA 02 80 00 2A FD AA 03 80 00 2A 22 80 F7 AA')
+    expected = bytes.fromhex('AA AA AA 80 00 2A AA AA AA AA 80 00 2A 22 AA AA AA AA AA AA AA AA AA AA')
+
+    assert unpack_bits(packed) == expected
+    assert unpack_bits(b'') == b''
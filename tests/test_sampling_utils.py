@@ -0,0 +1,100 @@
+"""
+Tests of sampling utilities
+"""
+
+import pytest
+import numpy as np
+import shapely.affinity
+from shapely.geometry import Polygon, MultiPolygon, Point, LineString, GeometryCollection
+
+from classification_service.sampling_utils import AreaSampler, get_triangle_areas, minkowski_sum, triangulate, \
+    count_points, random_sample_windows
+from classification_service.constants import SamplingEngine
+from benchmarks.reference import get_random_triangles, get_star_polygon, sample_cumulative_areas, \
+    pairwise_minkowski_sum
+
+
+def test_alias_tables_represent_areas():
+    triangles = get_random_triangles(500, np.random.RandomState(0))
+    sampler = AreaSampler(triangles)
+
+    n_triangles = len(triangles)
+    alias_probabilities = sampler.probabilities.copy()
+    np.add.at(alias_probabilities, sampler.aliases, 1 - sampler.probabilities)
+
+    areas = get_triangle_areas(triangles)
+    np.testing.assert_allclose(alias_probabilities / n_triangles, areas / areas.sum(), atol=1e-12)
+
+
+def test_alias_sampler_matches_cumulative_sampler():
+    np.random.seed(0)
+    triangles = get_random_triangles(20, np.random.RandomState(0))
+    n_samples = 200000
+
+    alias_counts = np.bincount(AreaSampler(triangles).sample_triangles(n_samples), minlength=len(triangles))
+    cumulative_counts = np.bincount(sample_cumulative_areas(triangles, n_samples), minlength=len(triangles))
+
+    np.testing.assert_allclose(alias_counts / n_samples, cumulative_counts / n_samples, atol=0.01)
+
+
+def test_sampled_points_are_in_triangles():
+    np.random.seed(0)
+    polygon = get_star_polygon(100, np.random.RandomState(0))
+    sampler = AreaSampler(triangulate(polygon))
+
+    points = sampler.sample_points(1000)
+
+    assert np.isclose(sampler.area, polygon.area)
+    assert all(polygon.buffer(1e-6).contains(Point(point)) for point in points)
+
+
+def test_cascaded_minkowski_sum_matches_pairwise_union():
+    polygon = get_star_polygon(100, np.random.RandomState(0))
+    complement = polygon.convex_hull.difference(polygon)
+    window_shape = -20, -20
+
+    pairwise_sum = pairwise_minkowski_sum(complement, window_shape)
+    cascaded_sum = minkowski_sum(complement, window_shape)
+
+    assert abs(cascaded_sum.area - pairwise_sum.area) / pairwise_sum.area < 1e-9
+    assert cascaded_sum.symmetric_difference(pairwise_sum).area / pairwise_sum.area < 1e-9
+
+
+def test_count_points():
+    polygon = Polygon([(0, 0), (1, 0), (1, 1), (0, 1)])
+    multi_polygon = MultiPolygon([polygon, shapely.affinity.translate(polygon, xoff=2)])
+    collection = GeometryCollection([multi_polygon, Point(5, 5), LineString([(0, 0), (5, 5)])])
+
+    assert count_points(polygon) == 5
+    assert count_points(multi_polygon) == 10
+    assert count_points(collection) == 10
+    assert count_points(LineString([(0, 0), (5, 5)])) == 0
+    assert count_points(Polygon()) == 0
+
+
+def test_triangulation_covers_polygon_with_holes():
+    polygon = get_star_polygon(200, np.random.RandomState(0)).difference(Point(0, 0).buffer(300))
+
+    triangles = triangulate(polygon)
+
+    assert np.isclose(get_triangle_areas(triangles).sum(), polygon.area)
+    assert all(polygon.buffer(1e-6).contains(Point(centroid)) for centroid in triangles.mean(axis=1))
+
+
+@pytest.mark.parametrize('engine, geo_shape', [
+    (SamplingEngine.VECTOR, get_star_polygon(200, np.random.RandomState(0)).difference(Point(0, 0).buffer(300))),
+    (SamplingEngine.RASTER, Polygon([(0, 0), (300, 0), (300, 100), (100, 100), (100, 300), (0, 300)],
+                                    [[(20, 20), (60, 20), (60, 60), (20, 60)]]))
+])
+def test_random_sample_windows_are_inside_shape(engine, geo_shape):
+    np.random.seed(0)
+    window_shape = 50, 30
+
+    windows = random_sample_windows(geo_shape, window_shape, 200, engine=engine)
+
+    assert len(windows) == 200
+    for window in windows:
+        min_x, min_y, max_x, max_y = window.bounds
+        assert (max_x - min_x, max_y - min_y) == window_shape
+        assert all(float(coord).is_integer() for coord in window.bounds)
+        assert geo_shape.buffer(1e-6).contains(window)
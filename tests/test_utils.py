@@ -0,0 +1,78 @@
+"""
+Tests of utilities for transforming data between JSON and Python
+"""
+
+import json
+from enum import Enum, IntEnum
+
+import pytest
+import numpy as np
+
+from classification_service.utils import to_json, to_python
+from benchmarks.reference import round_trip_to_json, round_trip_to_python
+
+
+class Color(Enum):
+    RED = 'red'
+    BLUE = 'blue'
+
+
+class Level(IntEnum):
+    LOW = 1
+
+
+class Engine(str, Enum):
+    RASTER = 'raster'
+
+
+PAYLOADS = [
+    {},
+    [],
+    'string',
+    None,
+    {
+        'campaign_id': 'id',
+        'window_width': 512,
+        'maxcc': 0.5,
+        'is_active': True,
+        'aoi': None,
+        'data_list': [{'layer_name': 'Clouds', 'image_id': 'a' * 64}, {'layer_name': 'Shadows'}],
+        'vector_data': [{'type': 'Polygon', 'coordinates': [[(0.0, 0.0), (1.0, 0.0), (0.0, 1.0), (0.0, 0.0)]]}],
+        'nested_dict': {'inner_key': {'deepest_key': [[], {}, ()]}}
+    },
+    {1: 'int key', 2.5: 'float key', True: 'bool key', None: 'none key'},
+    {'int_enum': Level.LOW, 'str_enum': Engine.RASTER, 'numpy_float': np.float64(0.25)}
+]
+
+
+@pytest.mark.parametrize('payload', PAYLOADS)
+def test_conversion_matches_json_round_trip(payload):
+    json_payload = to_json(payload)
+
+    assert json_payload == round_trip_to_json(payload)
+    assert to_python(json_payload) == round_trip_to_python(json_payload)
+    assert json.dumps(json_payload) == json.dumps(round_trip_to_json(payload))
+
+
+def test_conversion_does_not_modify_input():
+    payload = {'some_key': [{'other_key': 1}]}
+
+    json_payload = to_json(payload)
+
+    assert payload == {'some_key': [{'other_key': 1}]}
+    assert json_payload == {'someKey': [{'otherKey': 1}]}
+    assert json_payload['someKey'] is not payload['some_key']
+
+
+def test_conversion_of_leaves_which_json_cannot_serialize():
+    payload = {'color_list': [Color.RED, Color.BLUE], 'count': np.int64(3), 'flag': np.bool_(False),
+               'size': np.float32(0.5)}
+
+    json_payload = to_json(payload)
+
+    assert json_payload == {'colorList': ['red', 'blue'], 'count': 3, 'flag': False, 'size': 0.5}
+    assert [type(value) for value in [json_payload['count'], json_payload['flag'], json_payload['size']]] == \
+        [int, bool, float]
+
+    with pytest.raises(TypeError):
+        to_json({'some_key': object()})